@@ -1,5 +1,8 @@
 # etl/etl/config.py
+import hashlib
 from pathlib import Path
+from threading import RLock
+from typing import Any, Callable, Dict
 from dotenv import load_dotenv
 from os import getenv
 
@@ -22,3 +25,152 @@ S3_ACCESS_KEY = getenv("S3_ACCESS_KEY", "minioadmin")
 S3_SECRET_KEY = getenv("S3_SECRET_KEY", "minioadmin")
 S3_BUCKET = getenv("S3_BUCKET", "reports")
 S3_ENDPOINT_URL =  getenv("S3_ENDPOINT_URL",'http://minio:9000')
+
+# Исполнитель job: "multiprocess" (ветки activity выполняются параллельно)
+# или "in_process" (всё в одном процессе, как раньше)
+ETL_EXECUTOR = getenv("ETL_EXECUTOR", "multiprocess")
+# Максимальное количество одновременно выполняемых шагов
+ETL_MAX_CONCURRENT = int(getenv("ETL_MAX_CONCURRENT", 4))
+# Максимальное количество шагов, одновременно пишущих в DWH
+ETL_DB_CONCURRENCY = int(getenv("ETL_DB_CONCURRENCY", 2))
+
+# Движок чтения xlsx: "auto" (calamine, если установлен python-calamine), "openpyxl", "calamine"
+ETL_EXCEL_ENGINE = getenv("ETL_EXCEL_ENGINE", "auto")
+# Пропускать столбцы отчёта, которых нет в mapping.yaml, вместо ошибки по файлу.
+# Файл, в котором нет полей плана загрузки его activity, всё равно отклоняется
+ETL_PRUNE_UNMAPPED = getenv("ETL_PRUNE_UNMAPPED", "true").lower() in ("1", "true", "yes")
+# CSV (header,key) с заголовками отчётов, сопоставленными нечётким поиском:
+# следующие запуски читают их как точные совпадения. По умолчанию не ведётся.
+# Файл стоит просматривать: ошибочную строку удалить (или удалить файл целиком),
+# верные сопоставления перенести в matches mapping.yaml
+ETL_HEADERS_FILE = getenv("ETL_HEADERS_FILE", "")
+# Каталог кэша разобранных отчётов (Parquet, нужен pyarrow). Пустая строка - кэш выключен
+ETL_REPORT_CACHE_DIR = getenv("ETL_REPORT_CACHE_DIR", "")
+# Группировать новые файлы по activity на стороне MongoDB (aggregate)
+ETL_GROUP_ON_SERVER = getenv("ETL_GROUP_ON_SERVER", "false").lower() in ("1", "true", "yes")
+
+# Сенсор новых файлов: "auto" (change stream, если MongoDB его поддерживает),
+# "change_stream" или "watermark" (опрос по возрастанию _id)
+ETL_SENSOR_MODE = getenv("ETL_SENSOR_MODE", "auto")
+ETL_SENSOR_INTERVAL = int(getenv("ETL_SENSOR_INTERVAL", 30))
+
+
+class ConfigRegistry():
+    def __init__(self, configs_dir: Path):
+        """Кэш YAML файлов каталога configs на процесс.
+
+        Файл разбирается и проверяется при первом обращении и перечитывается,
+        только если изменились время изменения или размер. Производные
+        словари (обратный индекс заголовков и т.п.) вычисляются один раз
+        на версию файла.
+
+        Args:
+            configs_dir (Path): Каталог конфигов
+        """
+        self.configs_dir = Path(configs_dir)
+        self._files: Dict[str, tuple] = {}
+        self._derived: Dict[tuple, tuple] = {}
+        self._lock = RLock()
+
+    def _entry(self, name: str) -> tuple:
+        """(версия файла, разобранный YAML, sha256 содержимого)"""
+        path = self.configs_dir / name
+        stat = path.stat()
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._files.get(name)
+            if entry is None or entry[0] != stamp:
+                import yaml
+                raw = path.read_bytes()
+                loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+                data = yaml.load(raw.decode("utf-8"), Loader=loader)
+                validate = CONFIG_VALIDATORS.get(name)
+                if validate is not None:
+                    validate(data)
+                entry = (stamp, data, hashlib.sha256(raw).hexdigest())
+                self._files[name] = entry
+            return entry
+
+    def load(self, name: str) -> Any:
+        """Разобранный YAML файл. Результат общий, изменять его нельзя"""
+        return self._entry(name)[1]
+
+    def digest(self, name: str) -> str:
+        """sha256 содержимого файла"""
+        return self._entry(name)[2]
+
+    def derived(self, name: str, build: Callable[[Any], Any]) -> Any:
+        """Значение `build(данные файла)`, пересчитывается после изменения файла"""
+        stamp, data, _ = self._entry(name)
+        key = (name, build)
+        with self._lock:
+            cached = self._derived.get(key)
+            if cached is None or cached[0] != stamp:
+                cached = (stamp, build(data))
+                self._derived[key] = cached
+            return cached[1]
+
+
+def validate_mapping(mapping: Dict) -> None:
+    """Каждое поле mapping.yaml описывается словарём со списком `matches`"""
+    if not isinstance(mapping, dict) or not mapping:
+        raise ValueError("mapping.yaml is empty")
+    for name, field in mapping.items():
+        if not isinstance(field, dict) or not isinstance(field.get("matches"), list):
+            raise ValueError(f"mapping.yaml: field '{name}' has no 'matches' list")
+
+
+def validate_schema(schema: Dict) -> None:
+    """В schema.yaml есть разделы dimensions и facts"""
+    for section in ("dimensions", "facts"):
+        if not isinstance(schema, dict) or not isinstance(schema.get(section), dict):
+            raise ValueError(f"schema.yaml: section '{section}' is missing")
+
+
+CONFIG_VALIDATORS: Dict[str, Callable[[Any], None]] = {
+    "mapping.yaml": validate_mapping,
+    "schema.yaml": validate_schema,
+}
+CONFIGS = ConfigRegistry(CONFIGS_DIR)
+
+
+def build_header_index(mapping: Dict) -> Dict[str, str]:
+    """Название столбца отчёта: стандартное имя поля"""
+    return {
+        match: name
+        for name, field in mapping.items()
+        for match in field["matches"]
+    }
+
+
+def build_field_mapping(mapping: Dict) -> Dict[str, str]:
+    """Ключ "таблица.поле БД": стандартное имя поля"""
+    return {
+        f'{field["db_table"]}.{field["db_field"]}': name
+        for name, field in mapping.items()
+    }
+
+
+def build_field_types(mapping: Dict) -> Dict[str, str]:
+    """Стандартное имя поля: тип из mapping.yaml"""
+    return {name: field.get("type") for name, field in mapping.items()}
+
+
+def get_schema() -> Dict:
+    return CONFIGS.load("schema.yaml")
+
+
+def get_mapping() -> Dict:
+    return CONFIGS.load("mapping.yaml")
+
+
+def get_header_index() -> Dict[str, str]:
+    return CONFIGS.derived("mapping.yaml", build_header_index)
+
+
+def get_field_mapping() -> Dict[str, str]:
+    return CONFIGS.derived("mapping.yaml", build_field_mapping)
+
+
+def get_field_types() -> Dict[str, str]:
+    return CONFIGS.derived("mapping.yaml", build_field_types)
@@ -1,7 +1,8 @@
-from dagster import Definitions, mem_io_manager  #, load_assets_from_modules
+from dagster import Definitions, fs_io_manager, mem_io_manager  #, load_assets_from_modules
 #from etl import assets  # noqa: TID252
 from etl import resources  # noqa: TID252etl\resources.py
-from etl.pipelines import graph  # noqa: TID252
+from etl.pipelines import graph, sensors  # noqa: TID252
+from etl.config import ETL_EXECUTOR
 #all_assets = load_assets_from_modules([assets])
 
 defs = Definitions(
@@ -10,9 +11,13 @@ defs = Definitions(
         "mongo_client": resources.mongo_client_resource,
         "s3_client": resources.s3_client_resource,
         "target_db": resources.target_db_resource,
-        "io_manager": mem_io_manager,
+        # mem_io_manager работает только внутри одного процесса
+        "io_manager": mem_io_manager if ETL_EXECUTOR == "in_process" else fs_io_manager,
     },
     jobs=[
         graph.process_all_new_files
+    ],
+    sensors=[
+        sensors.new_files_sensor
     ]
 )
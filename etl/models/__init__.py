@@ -1,4 +1,20 @@
-from .minio_model import Minio
-from .mongo_model import MongoDB
-from .pg_model import DWHModel
-from .data_models import Meta
\ No newline at end of file
+from importlib import import_module
+
+# Модели импортируются при первом обращении: `from etl.models import Meta`
+# не тянет за собой sqlalchemy, boto3 и pymongo
+_LAZY_MODELS = {
+    "Minio": ".minio_model",
+    "MongoDB": ".mongo_model",
+    "DWHModel": ".pg_model",
+    "Meta": ".data_models",
+}
+
+__all__ = list(_LAZY_MODELS)
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_MODELS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_LAZY_MODELS[name], __name__), name)
+    globals()[name] = value
+    return value
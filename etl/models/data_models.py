@@ -1,7 +1,6 @@
 
 from dataclasses import dataclass
 from typing import Dict, List
-import yaml
 
 
 @dataclass
@@ -64,6 +63,7 @@ class MappingSchema():
             columns (List): _description_
             schema (str): path to schema yaml file
         """
+        import yaml
         with open(schema, 'r', encoding="UTF.8" ) as f:
             self.schema = yaml.safe_load(f)
         self.columns = columns
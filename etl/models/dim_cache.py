@@ -0,0 +1,97 @@
+from collections import Counter, OrderedDict
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class DimensionCache():
+    def __init__(self, max_size: int = 100_000):
+        """Кэш соответствия натуральных ключей измерений суррогатным идентификаторам.
+
+        Для каждой пары (таблица, набор полей ключа) хранится отдельный
+        словарь с вытеснением давно не использованных ключей (LRU).
+        Порядок полей не важен: ("region", "settlement") и
+        ("settlement", "region") попадают в один и тот же словарь.
+
+        Кэш общий для моделей процесса (`get_dim_cache`), поэтому
+        чтение и запись выполняются под блокировкой.
+
+        Args:
+            max_size (int, optional): Максимальное количество ключей
+                для одного измерения. Defaults to 100_000.
+        """
+        self.max_size = max_size
+        self._data: Dict[Tuple[str, Tuple[str, ...]], OrderedDict] = {}
+        self._lock = Lock()
+        # Ключи (таблица, поля), уже прогретые из БД
+        self.warmed = set()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    @staticmethod
+    def _order(fields: List[str]) -> Tuple[Tuple[str, ...], List[int]]:
+        """Возвращает отсортированные имена полей и порядок их индексов"""
+        order = sorted(range(len(fields)), key=lambda i: fields[i])
+        return tuple(fields[i] for i in order), order
+
+    def get_many(
+            self,
+            table: str,
+            fields: List[str],
+            keys: List[tuple]
+            ) -> List[Optional[int]]:
+        """
+        Возвращает идентификаторы для списка ключей в том же порядке.
+        Для ключей, которых нет в кэше, возвращается None.
+        """
+        names, order = self._order(fields)
+        result = []
+        with self._lock:
+            storage = self._data.get((table, names))
+            for key in keys:
+                key = tuple(key[i] for i in order)
+                value = storage.get(key) if storage is not None else None
+                if value is None:
+                    self.misses[table] += 1
+                else:
+                    self.hits[table] += 1
+                    storage.move_to_end(key)
+                result.append(value)
+        return result
+
+    def put_many(
+            self,
+            table: str,
+            fields: List[str],
+            items: Iterable[Tuple[tuple, int]]
+            ) -> None:
+        """Сохраняет пары (ключ, идентификатор) в кэш измерения"""
+        names, order = self._order(fields)
+        with self._lock:
+            storage = self._data.setdefault((table, names), OrderedDict())
+            for key, value in items:
+                if value is None:
+                    continue
+                key = tuple(key[i] for i in order)
+                storage[key] = value
+                storage.move_to_end(key)
+                if len(storage) > self.max_size:
+                    storage.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.warmed.clear()
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.hits.clear()
+            self.misses.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Возвращает количество попаданий и промахов по каждой таблице"""
+        with self._lock:
+            return {
+                table: {"hits": self.hits[table], "misses": self.misses[table]}
+                for table in sorted(set(self.hits) | set(self.misses))
+            }
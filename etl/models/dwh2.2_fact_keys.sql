@@ -0,0 +1,18 @@
+-- Натуральные ключи фактов (unique_key в schema.yaml).
+-- Нужны для загрузки фактов через INSERT ... ON CONFLICT (target_db.fact_upsert).
+-- Перед созданием индексов дубликаты по ключу нужно удалить.
+-- NULLS NOT DISTINCT требует PostgreSQL 15+
+DROP INDEX IF EXISTS "fact_events_key_idx";
+CREATE UNIQUE INDEX "fact_events_key_idx" ON "fact_events" ("date_id", "location_id", "event_id", "audience_id", "event_name", "organizer_id", "partner_id") NULLS NOT DISTINCT;
+
+DROP INDEX IF EXISTS "volunteers_in_events_key_idx";
+CREATE UNIQUE INDEX "volunteers_in_events_key_idx" ON "volunteers_in_events" ("volunteer_id", "fact_event_id") NULLS NOT DISTINCT;
+
+DROP INDEX IF EXISTS "fact_trainings_key_idx";
+CREATE UNIQUE INDEX "fact_trainings_key_idx" ON "fact_trainings" ("start_date_id", "end_date_id", "location_id", "staff_id", "training_program_id", "training_provider_id") NULLS NOT DISTINCT;
+
+DROP INDEX IF EXISTS "fact_edu_integrations_key_idx";
+CREATE UNIQUE INDEX "fact_edu_integrations_key_idx" ON "fact_edu_integrations" ("edu_program_id", "organization_id", "location_id", "date_id") NULLS NOT DISTINCT;
+
+DROP INDEX IF EXISTS "fact_im_placements_key_idx";
+CREATE UNIQUE INDEX "fact_im_placements_key_idx" ON "fact_im_placements" ("date_id", "info_mat_id", "placement_point_id", "location_id", "audience_id", "partner_id", "organizer_id") NULLS NOT DISTINCT;
@@ -0,0 +1,90 @@
+import hashlib
+import os
+from pathlib import Path
+from shutil import copyfileobj
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from typing import BinaryIO, Dict, Optional
+
+
+class DownloadCache():
+    def __init__(self, cache_dir: str, max_bytes: int = 2 * 1024 ** 3):
+        """Кэш скачанных из S3 файлов на локальном диске.
+
+        Файл хранится под именем sha256(bucket/key/ETag), поэтому изменённый
+        в S3 объект (с новым ETag) попадает в кэш заново, а старая копия
+        вытесняется. Время изменения файла обновляется при каждом чтении,
+        при превышении `max_bytes` удаляются давно не читавшиеся файлы (LRU).
+
+        Args:
+            cache_dir (str): Каталог кэша
+            max_bytes (int, optional): Максимальный размер кэша в байтах.
+                Defaults to 2 ГБ.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, bucket: str, key: str, etag: str) -> Path:
+        etag = etag.strip('"')
+        digest = hashlib.sha256(f"{bucket}/{key}/{etag}".encode()).hexdigest()
+        return self.cache_dir / digest[:2] / digest
+
+    def open(self, bucket: str, key: str, etag: str) -> Optional[BinaryIO]:
+        """Возвращает открытый на чтение файл из кэша или None"""
+        path = self.path(bucket, key, etag)
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return file
+
+    def put(self, bucket: str, key: str, etag: str, source: BinaryIO) -> None:
+        """
+        Копирует `source` в кэш с текущей позиции и возвращает позицию
+        обратно. Запись атомарная: файл сначала пишется во временный
+        и переименовывается.
+        """
+        path = self.path(bucket, key, etag)
+        path.parent.mkdir(exist_ok=True)
+        position = source.tell()
+        with NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as tmp:
+            try:
+                copyfileobj(source, tmp)
+            except Exception:
+                os.remove(tmp.name)
+                raise
+        os.replace(tmp.name, path)
+        source.seek(position)
+        self.evict()
+
+    def evict(self) -> None:
+        """Удаляет давно не читавшиеся файлы, пока кэш больше `max_bytes`"""
+        with self._lock:
+            files = []
+            for path in self.cache_dir.glob("??/*"):
+                if path.suffix == ".tmp":
+                    continue
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
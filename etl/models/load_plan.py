@@ -0,0 +1,140 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+@dataclass
+class DimensionStep():
+    """Замена полей отчёта идентификатором строки измерения
+
+    Args:
+        table (str): Таблица измерения
+        lookup_fields (List[str]): Поля отчёта, по которым ищется строка измерения
+        target_fields (List[str], optional): Поля отчёта, которые заменяются
+            идентификатором. По умолчанию `lookup_fields`
+        key_col (str, optional): Идентификатор измерения. По умолчанию `id`
+            таблицы из schema.yaml
+        custom_col (str, optional): Имя столбца с идентификатором в таблице
+            фактов, если оно отличается от `key_col`
+    """
+    table: str
+    lookup_fields: List[str]
+    target_fields: Optional[List[str]] = None
+    key_col: Optional[str] = None
+    custom_col: str = ""
+
+    @property
+    def id_col(self) -> str:
+        """Столбец, в который записывается идентификатор"""
+        return self.custom_col or self.key_col
+
+
+@dataclass
+class BridgeStep():
+    """Таблица связи факта со списком значений в одной ячейке отчёта
+    (например, волонтёры мероприятия)
+
+    Args:
+        table (str): Таблица связи
+        list_field (str): Поле отчёта со списком значений
+        dimension (str): Таблица измерения значений списка
+        key_col (str): Идентификатор измерения
+        dimension_fields (Dict[str, str]): Поле измерения: поле отчёта.
+            Поле со значением `list_field` получает отдельное значение списка
+        dim_col (str): Столбец идентификатора измерения в таблице связи
+        fact_col (str): Столбец идентификатора факта в таблице связи
+        separator (str, optional): Разделитель значений списка
+        clean_pattern (str, optional): Символы, удаляемые из значений
+    """
+    table: str
+    list_field: str
+    dimension: str
+    key_col: str
+    dimension_fields: Dict[str, str]
+    dim_col: str
+    fact_col: str
+    separator: str = ", "
+    clean_pattern: str = ""
+
+    @property
+    def report_fields(self) -> List[str]:
+        """Поля отчёта, которые не попадают в таблицу фактов"""
+        return list(dict.fromkeys([self.list_field, *self.dimension_fields.values()]))
+
+
+@dataclass
+class LoadPlan():
+    """План загрузки activity: измерения, даты и таблица фактов
+
+    Args:
+        fact_table (str): Таблица фактов
+        dimensions (List[DimensionStep]): Измерения в порядке разрешения.
+            Шаги по разным таблицам выполняются параллельно, по одной
+            таблице - по порядку
+        date_fields (List[str], optional): Поля дат, которые заменяются
+            ключом dim_date
+        name (str, optional): Имя activity для логов
+        defaults (Dict[str, Any], optional): Значения полей, которых нет в отчёте
+        fallbacks (Dict[str, str], optional): Поле: поле отчёта, из которого
+            берётся значение, если поля нет
+        random_dates (Dict[str, Tuple[str, str]], optional): Поле: диапазон
+            случайной даты, если поля нет в отчёте
+        bridges (List[BridgeStep], optional): Таблицы связи, загружаются
+            после таблицы фактов
+    """
+    fact_table: str
+    dimensions: List[DimensionStep]
+    date_fields: List[str] = field(default_factory=list)
+    name: str = ""
+    defaults: Dict[str, Any] = field(default_factory=dict)
+    fallbacks: Dict[str, str] = field(default_factory=dict)
+    random_dates: Dict[str, Tuple[str, str]] = field(default_factory=dict)
+    bridges: List[BridgeStep] = field(default_factory=list)
+
+    @property
+    def report_fields(self) -> List[str]:
+        """Поля отчёта, которые читает план: измерения, даты и таблицы связи"""
+        fields = []
+        for step in self.dimensions:
+            fields += step.lookup_fields + (step.target_fields or [])
+        fields += self.date_fields
+        for bridge in self.bridges:
+            fields += bridge.report_fields
+        return list(dict.fromkeys(fields))
+
+    def missing_fields(self, columns: Iterable[str]) -> List[str]:
+        """
+        Возвращает поля плана, которых нет среди столбцов отчёта `columns`
+        и которые не заполняются значениями по умолчанию, случайными датами
+        или из другого поля (`fallbacks`).
+        """
+        columns = set(columns)
+        missing = []
+        for name in self.report_fields:
+            if name in columns or name in self.defaults or name in self.random_dates:
+                continue
+            if self.fallbacks.get(name) in columns:
+                continue
+            missing.append(name)
+        return missing
+
+
+def parse_plans(config: Dict[str, Any]) -> Dict[str, LoadPlan]:
+    """Создаёт планы загрузки из словаря activities.yaml
+
+    Args:
+        config (Dict[str, Any]): activity_id: описание плана
+
+    Returns:
+        Dict[str, LoadPlan]: План по строковому activity_id
+    """
+    plans = {}
+    for activity_id, plan in (config or {}).items():
+        plan = dict(plan)
+        plan["dimensions"] = [DimensionStep(**step) for step in plan.get("dimensions", [])]
+        plan["bridges"] = [BridgeStep(**step) for step in plan.get("bridges", [])]
+        plan["random_dates"] = {
+            name: tuple(bounds) for name, bounds in plan.get("random_dates", {}).items()
+        }
+        plans[str(activity_id)] = LoadPlan(**plan)
+    return plans
+
@@ -1,10 +1,19 @@
 """_summary_
 """
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from typing import BinaryIO
-import boto3
+from shutil import copyfileobj
+from tempfile import SpooledTemporaryFile
+from threading import Lock
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional, Tuple
+from dagster import get_dagster_logger
 from etl import config
+from etl.models.file_cache import DownloadCache
+
+logger = get_dagster_logger()
+
 
 class Minio():
     def __init__(
@@ -13,23 +22,67 @@ class Minio():
             access_key: str = config.S3_ACCESS_KEY,
             secret_key: str = config.S3_SECRET_KEY,
             bucket: str = config.S3_BUCKET,
+            max_workers: int = 8,
+            spool_threshold: int = 32 * 1024 * 1024,
+            chunk_size: int = 1024 * 1024,
+            cache: Optional[DownloadCache] = None,
             ):
-        self.client = boto3.client(
-            's3',
-            endpoint_url=endpoint,
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            region_name='us-east-1'
-        )
+        """
+        Args:
+            max_workers (int, optional): Количество потоков для параллельного
+                скачивания файлов в `iter_get`. Defaults to 8.
+            spool_threshold (int, optional): Размер в байтах, после которого
+                файл из `get_stream` хранится не в памяти, а во временном
+                файле на диске. Defaults to 32 МБ.
+            chunk_size (int, optional): Размер блока чтения из S3 в байтах.
+                Defaults to 1 МБ.
+            cache (DownloadCache, optional): Локальный кэш скачанных файлов.
+                Если задан, `get` и `get_stream` сверяют ETag объекта через
+                head_object и не скачивают неизменённые файлы повторно.
+
+        Клиент S3 создаётся, а наличие бакета проверяется при первом
+        обращении к `client`, поэтому конструктор не обращается к сети.
+        """
+        self.max_workers = max(1, max_workers)
+        self.spool_threshold = spool_threshold
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.endpoint = endpoint
+        self.access_key = access_key
+        self.secret_key = secret_key
         self.bucket_name = bucket
-        if not self.__has_bucket():
-            raise Exception(f"Bucket {self.bucket_name} does not exist")
+        self._client = None
+        self._client_lock = Lock()
+
+    @property
+    def client(self):
+        """Клиент S3, создаётся при первом обращении"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import boto3
+                    client = boto3.client(
+                        's3',
+                        endpoint_url=self.endpoint,
+                        aws_access_key_id=self.access_key,
+                        aws_secret_access_key=self.secret_key,
+                        region_name='us-east-1'
+                    )
+                    if not self.__has_bucket(client):
+                        raise Exception(f"Bucket {self.bucket_name} does not exist")
+                    self._client = client
+        return self._client
 
-    def __has_bucket(self) -> bool:
+    @client.setter
+    def client(self, client) -> None:
+        """Готовый клиент S3 (например, с другими настройками), без проверки бакета"""
+        self._client = client
+
+    def __has_bucket(self, client) -> bool:
         try:
-            self.client.head_bucket(Bucket=self.bucket_name)
+            client.head_bucket(Bucket=self.bucket_name)
             return True
-        except self.client.exceptions.NoSuchBucket:
+        except client.exceptions.NoSuchBucket:
             return False
         except Exception as e:
             print(f"S3_STORAGE Error: {e}")
@@ -44,7 +97,133 @@ class Minio():
         Returns:
             BinaryIO: Объект типа StreamingBody имеющий интерфейс как у объекта file
         """
+        if self.cache is not None:
+            with self.get_stream(file_name) as file:
+                return BytesIO(file.read())
+        response = self.client.get_object(
+            Bucket=self.bucket_name,
+            Key=file_name)
+        return BytesIO(response['Body'].read())
+
+    def get_etag(self, file_name: str) -> str:
+        """Возвращает ETag объекта без кавычек. Ошибки head_object не перехватываются"""
+        head = self.client.head_object(Bucket=self.bucket_name, Key=file_name)
+        return head['ETag'].strip('"')
+
+    def get_etags(self, file_names: Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+        Запрашивает ETag нескольких объектов параллельно в `max_workers` потоков.
+        Если ETag объекта получить не удалось, причина пишется в лог,
+        а вместо ETag возвращается None: такой файл скачивается и
+        разбирается мимо кэша
+        """
+        def get_etag_or_none(file_name: str) -> Optional[str]:
+            try:
+                return self.get_etag(file_name)
+            except Exception as e:
+                logger.warning(f"Minio:\t {file_name}: no ETag, cache bypassed: {e}")
+                return None
+
+        names = list(file_names)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return dict(zip(names, pool.map(get_etag_or_none, names)))
+
+    def get_stream(self, file_name: str) -> BinaryIO:
+        """
+        Скачивает файл блоками по `chunk_size` без промежуточной копии
+        всего объекта в памяти. Файлы больше `spool_threshold` сохраняются
+        во временный файл на диске.
+        Args:
+            file_name (str): имя файла для скачивания
+
+        Returns:
+            BinaryIO: SpooledTemporaryFile, установленный на начало.
+            Вызывающий код должен закрыть его после чтения. При попадании
+            в кэш - открытый файл кэша
+        """
+        if self.cache is not None:
+            head = self.client.head_object(Bucket=self.bucket_name, Key=file_name)
+            cached = self.cache.open(self.bucket_name, file_name, head['ETag'])
+            if cached is not None:
+                return cached
         response = self.client.get_object(
             Bucket=self.bucket_name,
             Key=file_name)
-        return BytesIO(response['Body'].read())
\ No newline at end of file
+        body = response['Body']
+        buffer = SpooledTemporaryFile(max_size=self.spool_threshold)
+        try:
+            copyfileobj(body, buffer, self.chunk_size)
+        except Exception:
+            buffer.close()
+            raise
+        finally:
+            body.close()
+        buffer.seek(0)
+        if self.cache is not None:
+            try:
+                self.cache.put(self.bucket_name, file_name, response['ETag'], buffer)
+            except OSError as e:
+                logger.warning(f"Minio:\t {file_name} not cached: {e}")
+        return buffer
+
+    def iter_get(
+            self,
+            file_names: Iterable[str]
+            ) -> Iterator[Tuple[str, Optional[BinaryIO], Optional[Exception]]]:
+        """
+        Скачивает файлы через `get_stream` параллельно в `max_workers` потоков
+        и отдаёт их в исходном порядке, пока вызывающий код обрабатывает
+        предыдущие. Вперёд скачивается не больше `2 * max_workers` файлов.
+        Отданные файлы закрывает вызывающий код.
+        Args:
+            file_names (Iterable[str]): имена файлов для скачивания
+
+        Yields:
+            Tuple[str, BinaryIO, Exception]: имя файла, содержимое файла
+            (None при ошибке) и ошибка скачивания (None если ошибки не было)
+        """
+        names = iter(file_names)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            try:
+                for name in names:
+                    pending.append((name, pool.submit(self.get_stream, name)))
+                    if len(pending) >= 2 * self.max_workers:
+                        break
+                while pending:
+                    name, future = pending.popleft()
+                    next_name = next(names, None)
+                    if next_name is not None:
+                        pending.append((next_name, pool.submit(self.get_stream, next_name)))
+                    try:
+                        body = future.result()
+                    except Exception as e:
+                        yield name, None, e
+                        continue
+                    yield name, body, None
+            finally:
+                # Генератор закрыт досрочно: освобождаем уже скачанные файлы
+                for _, future in pending:
+                    if future.cancel():
+                        continue
+                    try:
+                        future.result().close()
+                    except Exception:
+                        pass
+
+    def get_many(
+            self,
+            file_names: Iterable[str]
+            ) -> Iterator[Tuple[str, Optional[BinaryIO], Optional[Exception]]]:
+        """
+        То же, что `iter_get`, но каждый файл закрывается, как только
+        вызывающий код переходит к следующему. В памяти одновременно
+        находится не больше `2 * max_workers` файлов, каждый не больше
+        `spool_threshold` байт.
+        """
+        for name, body, error in self.iter_get(file_names):
+            try:
+                yield name, body, error
+            finally:
+                if body is not None:
+                    body.close()
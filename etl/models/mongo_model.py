@@ -1,5 +1,6 @@
-from typing import Dict, List
-from pymongo import MongoClient
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import ASCENDING, MongoClient, UpdateMany
 from etl import config
 from .data_models import Meta
 
@@ -13,8 +14,16 @@ class MongoDB():
             db: str = config.MONGO_DB,
             user: str = config.MONGO_USER,
             password: str = config.MONGO_PASSWORD,
-            collection: str = "reports"
+            collection: str = "reports",
+            status_batch_size: int = 1000
             ):
+        """
+        Args:
+            status_batch_size (int, optional): Максимальное количество
+                документов в одном update_many при обновлении статусов.
+                Defaults to 1000.
+        """
+        self.status_batch_size = status_batch_size
         self.client = MongoClient(
             host=host,
             port=port,
@@ -24,10 +33,73 @@ class MongoDB():
         self.db = self.client[db]
         self.collection = self.db[collection]
 
-    def get_files_by_status(self, status: str = 'new'):
+    def close(self) -> None:
+        """Закрывает соединения клиента MongoDB"""
+        self.client.close()
+
+    # Поля документа, которые нужны для обработки файла
+    FILE_PROJECTION = {"_id": 1, "activity.id": 1, "prefix": 1, "filename": 1}
+    # Статус файлов, захваченных запуском job на обработку
+    CLAIMED_STATUS = "processing"
+
+    def ensure_indexes(self) -> None:
+        """Создаёт индекс для выборки файлов по статусу и activity"""
+        self.collection.create_index(
+            [("status", ASCENDING), ("activity.id", ASCENDING)],
+            name="status_activity_idx"
+        )
+        self.collection.create_index(
+            [("lease.owner", ASCENDING)],
+            name="lease_owner_idx",
+            sparse=True
+        )
+        self.collection.create_index(
+            [("requeued_at", ASCENDING)],
+            name="requeued_at_idx",
+            sparse=True
+        )
+
+    @staticmethod
+    def _status_query(
+            status: str,
+            owner: Optional[str] = None,
+            activity_id: Any = None,
+            after_id: Any = None
+            ) -> Dict:
+        query = {} if status == "" else {'status': status}
+        if owner is not None:
+            query["lease.owner"] = owner
+        if activity_id is not None:
+            query["activity.id"] = activity_id
+        if after_id is not None:
+            query["_id"] = {"$gt": after_id}
+        return query
+
+    @staticmethod
+    def _to_file(item: Dict) -> Dict:
+        activity = item.get('activity') or {}
+        return {
+            "activity_id": activity.get("id"),
+            "filename": f"{item.get('prefix','')}/{item.get('filename','')}",
+            "document_id": item.get("_id")
+        }
+
+    def get_files_by_status(
+            self,
+            status: str = 'new',
+            limit: int = 0,
+            batch_size: int = 1000,
+            owner: Optional[str] = None
+            ):
         """
-        Получает коллекцию файлов с указанным статусом
-        :param status: Указывает документы с каким статусом запросить из коллеции
+        Получает коллекцию файлов с указанным статусом.
+        Документы читаются курсором порциями по `batch_size`,
+        из базы запрашиваются только нужные поля.
+        :param status: Указывает документы с каким статусом запросить из коллеции,
+            пустая строка - все документы
+        :param limit: Максимальное количество документов, 0 - без ограничения
+        :param batch_size: Количество документов в одной порции курсора
+        :param owner: Только файлы, захваченные этим владельцем (см. `claim_files`)
         :return: Возвращает генератор словаря 
         >>> {
         >>>     "activity_id": int,
@@ -35,31 +107,222 @@ class MongoDB():
         >>>     "document_id": str
         >>> }
         """
-        if status == "":
-            new_collection = self.collection.find()
-            for item in new_collection:
-                activity = item.get('activity') or {}
-                yield {
-                    "activity_id": activity.get("id"),
-                    "filename": f"{item.get('prefix','')}/{item.get('filename','')}",
-                    "document_id": item.get("_id")
-                }
-
-        new_collection = self.collection.find({'status': status})
-        for item in new_collection:
-            activity = item.get('activity') or {}
-            yield {
-                "activity_id": activity.get("id"),
-                "filename": f"{item.get('prefix','')}/{item.get('filename','')}",
-                "document_id": item.get("_id")
-            }
-
-    def update_status(self, statuses: List[Meta]) -> None:
+        query = self._status_query(status, owner)
+        cursor = self.collection.find(
+            query,
+            self.FILE_PROJECTION,
+            batch_size=batch_size,
+            limit=limit
+        ).sort("_id", ASCENDING)
+        for item in cursor:
+            yield self._to_file(item)
+
+    def get_file_groups(
+            self,
+            status: str = 'new',
+            limit: int = 0,
+            owner: Optional[str] = None,
+            after_id: Any = None
+            ) -> Dict[str, List[Dict]]:
+        """
+        Группирует файлы с указанным статусом по activity на стороне MongoDB.
+        :param status: Статус документов
+        :param limit: Максимальное количество документов, 0 - без ограничения
+        :param owner: Только файлы, захваченные этим владельцем (см. `claim_files`)
+        :param after_id: Только документы с _id больше указанного
+        :return: Словарь {activity_id: [файл1, файл2, ...]},
+            файлы в формате `get_files_by_status`
+        """
+        pipeline = [
+            {"$match": self._status_query(status, owner, after_id=after_id)},
+            {"$sort": {"_id": 1}},
+        ]
+        if limit:
+            pipeline.append({"$limit": limit})
+        pipeline.extend([
+            {"$project": self.FILE_PROJECTION},
+            {"$group": {"_id": "$activity.id", "files": {"$push": "$$ROOT"}}},
+        ])
+        return {
+            group["_id"]: [self._to_file(item) for item in group["files"]]
+            for group in self.collection.aggregate(pipeline)
+        }
+
+    def claim_files(
+            self,
+            owner: str,
+            limit: int = 0,
+            lease_seconds: int = 3600,
+            activity_id: Any = None
+            ) -> int:
+        """
+        Захватывает файлы со статусом "new" для обработки владельцем `owner`
+        (например, run_id запуска): статус меняется на "processing" и
+        записывается аренда {"owner": ..., "expires_at": ...}.
+        Обновление выполняется с условием status == "new", поэтому
+        параллельные запуски получают непересекающиеся наборы файлов.
+        Перед захватом возвращаются в очередь файлы с истёкшей арендой.
+        :param owner: Идентификатор владельца аренды
+        :param limit: Максимальное количество файлов, 0 - без ограничения
+        :param lease_seconds: Срок аренды в секундах
+        :param activity_id: Захватывать только файлы этой activity
+        :return: Количество захваченных файлов
+        """
+        now = datetime.now(timezone.utc)
+        self.release_expired_leases(now)
+        ids = [
+            item["_id"]
+            for item in self.collection.find(
+                self._status_query("new", activity_id=activity_id), {"_id": 1}, limit=limit
+            ).sort("_id", ASCENDING)
+        ]
+        lease = {"owner": owner, "expires_at": now + timedelta(seconds=lease_seconds)}
+        claimed = 0
+        for start in range(0, len(ids), self.status_batch_size):
+            result = self.collection.update_many(
+                {"_id": {"$in": ids[start:start + self.status_batch_size]}, "status": "new"},
+                {"$set": {"status": self.CLAIMED_STATUS, "lease": lease}}
+            )
+            claimed += result.modified_count
+        return claimed
+
+    def extend_lease(
+            self,
+            owner: str,
+            document_ids: List[Any],
+            lease_seconds: int = 3600
+            ) -> int:
+        """
+        Продлевает аренду файлов, захваченных владельцем `owner`, на
+        `lease_seconds` от текущего момента. Файлы, аренда которых уже
+        истекла и была снята, не продлеваются.
+        :param owner: Идентификатор владельца аренды
+        :param document_ids: Идентификаторы документов
+        :param lease_seconds: Срок аренды в секундах
+        :return: Количество файлов, аренда которых продлена
+        """
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)
+        extended = 0
+        for start in range(0, len(document_ids), self.status_batch_size):
+            result = self.collection.update_many(
+                {
+                    "_id": {"$in": document_ids[start:start + self.status_batch_size]},
+                    "status": self.CLAIMED_STATUS,
+                    "lease.owner": owner,
+                },
+                {"$set": {"lease.expires_at": expires_at}}
+            )
+            extended += result.matched_count
+        return extended
+
+    def release_expired_leases(self, now: Optional[datetime] = None) -> int:
+        """
+        Возвращает в статус "new" файлы, аренда которых истекла
+        (например, запуск упал, не обновив статусы). Время возврата
+        записывается в `requeued_at`, по нему сенсор находит такие файлы.
+        :return: Количество освобождённых файлов
+        """
+        now = now or datetime.now(timezone.utc)
+        result = self.collection.update_many(
+            {"status": self.CLAIMED_STATUS, "lease.expires_at": {"$lt": now}},
+            {"$set": {"status": "new", "requeued_at": now}, "$unset": {"lease": ""}}
+        )
+        return result.modified_count
+
+    def get_requeued_files(
+            self,
+            after: Optional[datetime] = None
+            ) -> Tuple[List[Dict], Optional[datetime]]:
+        """
+        Возвращает файлы со статусом "new", возвращённые в очередь
+        (`requeued_at`) позже `after`. Файлы, которые вернули в очередь
+        вручную, попадают сюда, если при этом записан `requeued_at`.
+        :return: Список файлов в формате `get_files_by_status`
+            и наибольшее `requeued_at` среди них (или `after`)
+        """
+        query = {"status": "new", "requeued_at": {"$exists": True}}
+        if after is not None:
+            query["requeued_at"] = {"$gt": after}
+        files = []
+        last = after
+        for item in self.collection.find(query, {**self.FILE_PROJECTION, "requeued_at": 1}):
+            files.append(self._to_file(item))
+            if last is None or item["requeued_at"] > last:
+                last = item["requeued_at"]
+        return files, last
+
+    def watch_new_files(
+            self,
+            resume_token: Optional[Dict] = None,
+            max_await_ms: int = 1000
+            ) -> Tuple[List[Dict], Dict]:
+        """
+        Читает из change stream коллекции документы со статусом "new",
+        вставленные или возвращённые в очередь (обновление статуса на "new")
+        после `resume_token`, не дожидаясь новых дольше `max_await_ms`.
+        Change stream доступен только на replica set / sharded cluster,
+        на одиночном сервере вызывает pymongo.errors.OperationFailure.
+        :return: Список файлов в формате `get_files_by_status`
+            и токен для продолжения чтения
+        """
+        pipeline = [
+            {"$match": {"$or": [
+                {"operationType": "insert", "fullDocument.status": "new"},
+                {"operationType": "update", "updateDescription.updatedFields.status": "new"},
+            ]}}
+        ]
+        files = []
+        with self.collection.watch(
+            pipeline,
+            resume_after=resume_token,
+            max_await_time_ms=max_await_ms,
+            full_document="updateLookup",
+        ) as stream:
+            while True:
+                change = stream.try_next()
+                if change is None:
+                    break
+                # Для обновления документ читается на момент чтения потока:
+                # его могли уже удалить или снова захватить
+                document = change.get("fullDocument")
+                if document is not None and document.get("status") == "new":
+                    files.append(self._to_file(document))
+            return files, stream.resume_token
+
+    def update_status(
+            self,
+            statuses: List[Meta],
+            owner: Optional[str] = None
+            ) -> Dict[str, int]:
+        """
+        Обновляет статусы документов и снимает с них аренду.
+        Документы с одинаковыми статусом и
+        причиной обновляются одним update_many по `status_batch_size` штук,
+        все запросы отправляются одним неупорядоченным bulk_write.
+        :param statuses: Список метаданных файлов
+        :param owner: Обновлять только файлы, аренда которых принадлежит
+            `owner`: файлы, потерявшие аренду и захваченные другим запуском,
+            не изменяются
+        :return: Количество найденных и изменённых документов
+        >>> {"matched": int, "modified": int}
+        """
+        lease = {} if owner is None else {"lease.owner": owner}
+        groups: Dict[tuple, list] = {}
         for item in statuses:
-            self.collection.update_one(
-                {"_id": item.document_id},
-                {"$set": {"status": item.status, "reason": item.reason}}
+            groups.setdefault((item.status, item.reason), []).append(item.document_id)
+        requests = []
+        for (status, reason), ids in groups.items():
+            for start in range(0, len(ids), self.status_batch_size):
+                requests.append(
+                    UpdateMany(
+                        {"_id": {"$in": ids[start:start + self.status_batch_size]}, **lease},
+                        {"$set": {"status": status, "reason": reason}, "$unset": {"lease": ""}}
+                    )
                 )
+        if not requests:
+            return {"matched": 0, "modified": 0}
+        result = self.collection.bulk_write(requests, ordered=False)
+        return {"matched": result.matched_count, "modified": result.modified_count}
 
 
 if __name__ == "__main__":
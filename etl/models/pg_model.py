@@ -1,18 +1,148 @@
+import os
 import pandas as pd
-import re
-from pandas.api.types import is_datetime64_any_dtype
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from io import StringIO
+from threading import Lock
+from pandas.api.types import is_float_dtype
 from time import sleep
 from numpy.dtypes import DateTime64DType
 from typing import Dict, List
 from sqlalchemy import create_engine, text
-from sqlalchemy.exc import DataError
-import yaml
-from itertools import zip_longest
-from etl.config import PACKAGE_ROOT
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DataError, IntegrityError
+from psycopg2 import IntegrityError as PgIntegrityError
+from psycopg2.extras import execute_values
+from etl.config import CONFIGS, get_field_mapping, get_mapping, get_schema
+from etl.tools import get_random_date, to_date_id
+from .dim_cache import DimensionCache
+from .load_plan import BridgeStep, DimensionStep, LoadPlan, parse_plans
 from dagster import get_dagster_logger
 
-DWH_SCHEMA = PACKAGE_ROOT / "configs/schema.yaml"
-MAPPING_SCHEMA = PACKAGE_ROOT / "configs/mapping.yaml"
+
+# Engine (и его пул соединений) общий для всех DWHModel процесса
+# с одинаковыми параметрами подключения
+_ENGINES: Dict[tuple, Engine] = {}
+_ENGINES_LOCK = Lock()
+
+
+def get_engine(
+    url: str,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_pre_ping: bool = True,
+    statement_timeout_ms: int = 0,
+) -> Engine:
+    """
+    Возвращает engine для `url` из реестра процесса, создавая его
+    при первом обращении. После fork дочерний процесс создаёт свой engine.
+    Args:
+        statement_timeout_ms (int, optional): statement_timeout сессии
+            в миллисекундах, 0 - без ограничения.
+    """
+    key = (os.getpid(), url, pool_size, max_overflow, pool_pre_ping, statement_timeout_ms)
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(key)
+        if engine is None:
+            connect_args = {}
+            if statement_timeout_ms:
+                connect_args["options"] = f"-c statement_timeout={statement_timeout_ms}"
+            engine = create_engine(
+                url,
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                pool_pre_ping=pool_pre_ping,
+                connect_args=connect_args,
+            )
+            _ENGINES[key] = engine
+        return engine
+
+
+# Кэш измерений общий для всех DWHModel процесса с одной БД: ресурс
+# создаёт модель на каждый шаг, а идентификаторы измерений от шага не зависят
+_DIM_CACHES: Dict[tuple, DimensionCache] = {}
+_DIM_CACHES_LOCK = Lock()
+
+
+def get_dim_cache(url: str, max_size: int) -> DimensionCache:
+    """
+    Возвращает кэш измерений для БД `url` из реестра процесса, создавая его
+    при первом обращении. После fork дочерний процесс создаёт свой кэш.
+    """
+    key = (os.getpid(), url, max_size)
+    with _DIM_CACHES_LOCK:
+        cache = _DIM_CACHES.get(key)
+        if cache is None:
+            cache = _DIM_CACHES[key] = DimensionCache(max_size)
+        return cache
+
+
+def to_copy_buffer(df: pd.DataFrame) -> StringIO:
+    """
+    Сериализует набор данных в CSV для `COPY ... FROM STDIN`.
+    Пустые значения записываются как `\\N`, а дробные столбцы, в которых
+    только целые значения (целочисленные поля с NaN после merge),
+    приводятся к Int64, иначе Postgres не примет `1.0` в поле int.
+    """
+    df = df.copy()
+    for col in df.columns:
+        if is_float_dtype(df[col]):
+            values = df[col].dropna()
+            if (values == values.round()).all():
+                df[col] = df[col].astype("Int64")
+    buffer = StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep="\\N")
+    buffer.seek(0)
+    return buffer
+
+
+def get_row_tuples(df: pd.DataFrame, fields: List[str]) -> List[tuple]:
+    """
+    Возвращает значения столбцов `fields` построчно в виде кортежей
+    с python-типами. Преобразование выполняется по столбцам целиком,
+    пустые значения (NaN, NaT, None) заменяются на None.
+    """
+    values = df[fields].astype(object)
+    values = values.where(values.notna(), None)
+    return [tuple(row) for row in values.to_numpy().tolist()]
+
+
+def explode_list_values(df: pd.DataFrame, bridge: BridgeStep) -> pd.DataFrame:
+    """
+    Разбивает списки значений в поле `bridge.list_field` на отдельные записи:
+    по одной на каждое значение списка. Запись хранит номер строки отчёта
+    `row` (позицию в `df`) и поля измерения `bridge.dimension_fields`,
+    очищенные по `bridge.clean_pattern` и от пробелов по краям.
+    Пустые списки (NaN) записей не дают, пустые значения списка сохраняются.
+    """
+    # astype(object): очистка тем же регулярным выражением модуля re
+    # (у строк pyarrow RE2, где \s не совпадает с неразрывным пробелом)
+    def clean(values: pd.Series) -> pd.Series:
+        values = values.astype(object)
+        if bridge.clean_pattern:
+            values = values.str.replace(bridge.clean_pattern, "", regex=True)
+        return values.str.strip()
+
+    list_col = next(
+        col for col, name in bridge.dimension_fields.items() if name == bridge.list_field
+    )
+    values = (
+        clean(
+            df[bridge.list_field].reset_index(drop=True).astype(object)
+            .str.split(bridge.separator)
+            .explode()
+            .dropna()
+        )
+        .rename(list_col)
+        .rename_axis("row")
+        .reset_index()
+    )
+    rows = values["row"].to_numpy()
+    for col, name in bridge.dimension_fields.items():
+        if col != list_col:
+            values[col] = clean(df[name]).to_numpy()[rows]
+    return values[["row", *bridge.dimension_fields]]
 
 
 class DWHModel:
@@ -23,16 +153,75 @@ class DWHModel:
         db_name: str,
         db_user: str,
         db_pass: str,
+        use_copy: bool = True,
+        insert_page_size: int = 1000,
+        lookup_chunk_size: int = 5000,
+        dim_cache_size: int = 100_000,
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        pool_pre_ping: bool = True,
+        statement_timeout_ms: int = 0,
+        fact_upsert: str = "",
+        dim_workers: int = 4,
     ):
-        self.engine = create_engine(
-            f"postgresql://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
+        """
+        Args:
+            use_copy (bool, optional): Загружать данные через временную таблицу
+                и `COPY FROM STDIN` вместо многострочного `INSERT ... VALUES`.
+                По умолчанию True.
+            insert_page_size (int, optional): Количество строк в одном
+                `INSERT ... VALUES`, если `use_copy` выключен. По умолчанию 1000.
+            lookup_chunk_size (int, optional): Количество ключей в одном
+                `WHERE (...) IN (...)` при поиске существующих записей.
+                По умолчанию 5000.
+            dim_cache_size (int, optional): Максимальное количество ключей
+                в кэше одного измерения, 0 - кэш выключен. Кэш общий для
+                моделей процесса с той же БД (`get_dim_cache`). По умолчанию 100_000.
+            pool_size, max_overflow, pool_pre_ping (optional): Параметры пула
+                соединений SQLAlchemy. Engine с одинаковыми параметрами
+                общий для всех моделей процесса (`get_engine`).
+            statement_timeout_ms (int, optional): Ограничение времени одного
+                запроса в миллисекундах, 0 - без ограничения.
+            fact_upsert (str, optional): Загрузка фактов с `unique_key` из
+                schema.yaml через `INSERT ... ON CONFLICT`: "nothing" - существующие
+                факты не меняются, "update" - перезаписываются. Пустая строка -
+                поиск существующих фактов по всем полям и вставка остальных.
+                Требует уникальных индексов из dwh2.2_fact_keys.sql.
+            dim_workers (int, optional): Количество потоков для параллельного
+                поиска существующих записей измерений плана загрузки,
+                1 - поиск по очереди в соединении загрузки. По умолчанию 4.
+        """
+        if fact_upsert not in ("", "nothing", "update"):
+            raise ValueError(f"Unknown fact_upsert mode: {fact_upsert}")
+        url = f"postgresql+psycopg2://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
+        self.engine = get_engine(
+            url,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_pre_ping=pool_pre_ping,
+            statement_timeout_ms=statement_timeout_ms,
         )
+        # Соединение, открытое `connection` на время dispatch, и идентификаторы
+        # измерений, которые попадут в кэш после COMMIT
+        self._conn = None
+        self._staged_ids = []
+        # Таблицы измерений, заблокированные текущей транзакцией (`_lock_dimensions`)
+        self._locked = set()
+        self.use_copy = use_copy
+        self.insert_page_size = insert_page_size
+        self.lookup_chunk_size = lookup_chunk_size
+        self.dim_cache = get_dim_cache(url, dim_cache_size) if dim_cache_size else None
+        self.fact_upsert = fact_upsert
+        self.dim_workers = dim_workers
+        # Типы столбцов таблиц для приведения значений поиска (`_column_types`)
+        self._table_types: Dict[str, Dict[str, str]] = {}
+        # Диапазон date_id в dim_date, читается из БД при первой проверке
+        self._date_id_range = None
         self.logger = get_dagster_logger(self.__class__.__name__)
 
-        with open(DWH_SCHEMA, "r", encoding="utf-8") as f:
-            self.schema = yaml.safe_load(f)
-        with open(MAPPING_SCHEMA, "r", encoding="utf-8") as f:
-            self.mapping = yaml.safe_load(f)
+        # Общие для процесса словари реестра конфигов, изменять их нельзя
+        self.schema = get_schema()
+        self.mapping = get_mapping()
         """
             {'region': 
                     {
@@ -45,31 +234,66 @@ class DWHModel:
         """
         self.dimensions = self.schema["dimensions"]
         self.facts = self.schema["facts"]
-        self.field_mapping = {
-            f'{self.mapping[df_field]["db_table"]}.{self.mapping[df_field]["db_field"]}': df_field
-            for df_field in self.mapping.keys()
-        }
-        self.HandlerMap: Dict[str, callable] = {
-            "1": self.load_events_facts,
-            "2": self.load_edu_integrations_facts,
-            "3": self.load_im_placements_facts,
-            "4": self.load_trainig_facts,
+        self.field_mapping = get_field_mapping()
+        # Планы загрузки activity из activities.yaml, проверяются один раз
+        self.plans: Dict[str, LoadPlan] = {
+            activity_id: self.compile_plan(plan)
+            for activity_id, plan in CONFIGS.derived("activities.yaml", parse_plans).items()
         }
 
-    def dispatch(self, activity_id: str, df: pd.DataFrame) -> None:
-        if activity_id not in self.HandlerMap.keys():
-            self.logger.error(f"Unknown activity_id: {activity_id}")
-            return 0      
-        ids = self.HandlerMap[activity_id](df)
+    def dispatch(self, activity_id: str, df: pd.DataFrame) -> int:
+        """
+            Загружает отчёты activity по её плану из activities.yaml.
+            Возвращает количество загруженных фактов.
+            Raises:
+                ValueError: для activity нет плана загрузки
+        """
+        if activity_id not in self.plans:
+            raise ValueError(f"Unknown activity_id: {activity_id}")
+        # Вся загрузка activity идёт на одном соединении в одной транзакции:
+        # при ошибке в БД не остаётся ни измерений, ни части фактов
+        with self.connection():
+            ids = self.execute_plan(df, self.plans[activity_id])
+        self.log_dim_cache_stats()
         return len(ids)
 
+    @contextmanager
+    def connection(self):
+        """
+            Соединение для запросов модели. Внутри `dispatch` все запросы
+            выполняются на одном соединении и фиксируются одним COMMIT,
+            вне его каждый вызов открывает и фиксирует свою транзакцию.
+            Идентификаторы, найденные и вставленные в транзакции, попадают
+            в кэш измерений только после COMMIT.
+        """
+        if self._conn is not None:
+            yield self._conn
+            return
+        try:
+            with self.engine.begin() as conn:
+                self._conn = conn
+                try:
+                    yield conn
+                finally:
+                    self._conn = None
+                    self._locked = set()
+        except BaseException:
+            self._staged_ids = []
+            raise
+        staged, self._staged_ids = self._staged_ids, []
+        for table, lookup_fields, items in staged:
+            self.dim_cache.put_many(table, lookup_fields, items)
+
     def load_to_fact_table(
         self,
         df: pd.DataFrame,
         table: str,
-        lookup_fields: List[str],
     ) -> pd.DataFrame:
-
+        """
+            Загружает факты и возвращает набор данных с идентификатором факта.
+            Существующие факты ищутся по всем полям набора, а при `fact_upsert` -
+            по `unique_key` таблицы из schema.yaml.
+        """
         # Сопоставляем полям из отчета поля из БД если они есть иначе оставляем как есть
         db_key_mapping = {}
         for field in df.columns:
@@ -80,15 +304,18 @@ class DWHModel:
 
         # Получаем поле ключ
         key_col = self.schema['facts'][table]['id']
-        # создадим новый список имён полей для поиска 
-        lookup_fields = [
-            db_key_mapping[field] for field in lookup_fields
-        ]
+        unique_key = self.facts[table].get("unique_key")
+        if self.fact_upsert and unique_key:
+            final_df = self.upsert_facts(
+                df.rename(columns=db_key_mapping), table, unique_key, key_col
+            )
+            return final_df.rename(columns={val: key for key, val in db_key_mapping.items()})
         # так как это таблица фактов в ней не может быть одинаковых полей,
         # поэтому создаем копию таблицы с переименованным столбцами
         renamed_df = df.rename(columns=db_key_mapping)
+        # Факт ищется по всем полям: одинаковые ключи измерений
+        # с разными показателями - разные факты
         lookup_fields = list(renamed_df.columns)
-        # target_columns = list(renamed_df.columns)
        
         found_rows = self.bulk_select(
             df=renamed_df[lookup_fields],
@@ -136,6 +363,52 @@ class DWHModel:
         }
         return final_df.rename(columns=old_col_names)
 
+    def upsert_facts(
+        self,
+        df: pd.DataFrame,
+        table: str,
+        unique_key: List[str],
+        key_col: str,
+    ) -> pd.DataFrame:
+        """
+            Загружает факты через `INSERT ... ON CONFLICT (unique_key)` и
+            возвращает набор данных с идентификатором факта `key_col` для
+            каждой строки (и новой, и уже существующей). Повторная загрузка
+            тех же строк не создаёт дубликатов.
+            Полные дубликаты строк внутри набора загружаются один раз
+            (с предупреждением в логе), строки с одинаковым ключом и разными
+            значениями остальных полей отклоняются.
+            Args:
+                df: pd.DataFrame - набор данных с именами полей таблицы
+                unique_key: List[str] - поля уникального индекса таблицы
+            Raises:
+                ValueError: в наборе есть разные строки с одинаковым ключом
+        """
+        result = df.copy()
+        if df.empty:
+            result[key_col] = pd.Series(dtype="Int64")
+            return result
+        rows_df = df.drop_duplicates()
+        if len(rows_df) < len(df):
+            self.logger.warning(
+                f"{table}: {len(df) - len(rows_df)} duplicate rows in batch, loaded once"
+            )
+        conflicts = rows_df[rows_df.duplicated(subset=unique_key, keep=False)]
+        if not conflicts.empty:
+            raise ValueError(
+                f"{table}: {len(conflicts)} rows share unique_key {unique_key} "
+                f"with different values, e.g. {get_row_tuples(conflicts, unique_key)[:5]}"
+            )
+        with self.connection() as conn:
+            rows = self._upsert_returning(
+                conn, rows_df, table, list(df.columns), key_col, unique_key
+            )
+        ids = {tuple(row[1:]): row[0] for row in rows}
+        result[key_col] = pd.array(
+            [ids.get(key) for key in get_row_tuples(df, unique_key)], dtype="Int64"
+        )
+        return result
+
     def process_dims(
         self,
         df: pd.DataFrame,
@@ -155,186 +428,355 @@ class DWHModel:
             lookup_fields (List[str]): Поля по которым идентифицируем запись в БД
             target_fields (List[str]): Поля которые необходимо заменить на идентификатор
             key_col (str): Название поля в БД которое будет использовано как идентификатор
-            batch_size (int, optional): Размер батча для вставки данных. По умолчанию 1000.
         """
-        # Проверяем наличие всех полей в словаре маппинга
+        return self.resolve_dimensions(
+            df,
+            [DimensionStep(table, lookup_fields, target_fields, key_col, custom_col)],
+        )
+
+    def resolve_dimensions(
+        self,
+        df: pd.DataFrame,
+        steps: List[DimensionStep],
+    ) -> pd.DataFrame:
+        """
+            Заменяет поля измерений идентификаторами для всех шагов плана.
+            1. Для каждого шага берётся срез уникальных ключей, известные
+               ключи берутся из кэша, остальные ищутся в БД. Поиск по разным
+               таблицам выполняется параллельно на отдельных соединениях пула
+               (`dim_workers`).
+            2. Новые ключи вставляются по порядку шагов в транзакции `connection`.
+               Если таблица уже менялась предыдущим шагом, поиск по ней
+               повторяется в этой транзакции, чтобы видеть вставленные строки.
+            3. Идентификаторы всех измерений присоединяются к набору данных
+               за один проход, поля измерений удаляются.
+        """
+        steps = [self._complete_step(step) for step in steps]
+        slices = [self._dimension_slice(df, step) for step in steps]
+
+        # Шаг 1: параллельный поиск промахов кэша в БД, по одной таблице -
+        # только первый шаг, остальные ищутся после его вставок. Таблицы,
+        # уже затронутые текущей транзакцией, ищутся в ней же: другие
+        # соединения не видят её незафиксированных строк
+        touched = {table for table, _, _ in self._staged_ids}
+        first_steps = {}
+        for i, step in enumerate(steps):
+            first_steps.setdefault(step.table, i)
+        found = {}
+        parallel = [
+            i for table, i in first_steps.items()
+            if table not in touched and not slices[i][2].empty
+        ]
+        if self.dim_workers > 1 and len(parallel) > 1:
+            with ThreadPoolExecutor(max_workers=self.dim_workers) as pool:
+                futures = {
+                    i: pool.submit(self._select_on_new_connection, slices[i][2], steps[i])
+                    for i in parallel
+                }
+                found = {i: future.result() for i, future in futures.items()}
+
+        # Таблицы, в которые по результатам поиска будут вставлены строки,
+        # блокируются сразу и в одном порядке (см. `_lock_dimensions`)
+        inserting = [
+            steps[i].table for i in first_steps.values()
+            if not slices[i][2].empty and (
+                i not in found
+                or len(found[i]) < len(slices[i][2][slices[i][0]].drop_duplicates())
+            )
+        ]
+        self._lock_dimensions(inserting)
+
+        # Шаг 2: вставка новых ключей в транзакции, по порядку шагов
+        resolved = []
+        for i, step in enumerate(steps):
+            l_fields, cached_df, missed_df = slices[i]
+            if i in found:
+                found_df = found[i]
+            else:
+                with self.connection() as conn:
+                    found_df = self._select_existing(
+                        conn, missed_df, step.table, l_fields, step.key_col
+                    )
+            self._cache_ids(found_df, step.table, l_fields, step.key_col)
+            existing_df = pd.concat([cached_df, found_df], ignore_index=True)
+            new_rows = missed_df.merge(
+                found_df[l_fields], on=l_fields, how="left", indicator=True
+            )
+            new_rows = new_rows[new_rows["_merge"] == "left_only"].drop(columns=["_merge"])
+            if not new_rows.empty:
+                try:
+                    df_new_ids = self._insert_dimension(
+                        new_rows, step.table, list(new_rows.columns), l_fields, step.key_col
+                    )
+                except DataError as e:
+                    self.logger.error(f"Error inserting data into {step.table}: {e}")
+                    raise e
+                existing_df = pd.concat(
+                    [existing_df, df_new_ids[[step.key_col] + l_fields]], ignore_index=True
+                )
+            # Обратно к именам полей отчёта; один идентификатор на ключ
+            existing_df = (
+                existing_df[[step.key_col] + l_fields]
+                .set_axis([step.id_col] + step.lookup_fields, axis=1)
+                .drop_duplicates(subset=step.lookup_fields)
+            )
+            resolved.append(existing_df)
+
+        # Шаг 3: присоединяем идентификаторы за один проход
+        ids = {}
+        for step, existing_df in zip(steps, resolved):
+            ids[step.id_col] = (
+                df[step.lookup_fields]
+                .merge(existing_df, on=step.lookup_fields, how="left")[step.id_col]
+                .to_numpy()
+            )
+        dropped = {field for step in steps for field in step.target_fields}
+        result = df.drop(columns=[col for col in df.columns if col in dropped or col in ids])
+        return result.assign(**ids)
+
+    def _complete_step(self, step: DimensionStep) -> DimensionStep:
+        """Заполняет значения шага по умолчанию и проверяет поля по mapping.yaml"""
+        target_fields = step.target_fields or step.lookup_fields
         if not all(
-            field in self.mapping 
-                for field in set(target_fields + lookup_fields)
+            field in self.mapping
+                for field in set(target_fields + step.lookup_fields)
         ):
             raise ValueError(
                 "Not all fields are present in the mapping dictionary."
                 )
-
-        slice_df = df[target_fields].copy()
-        slice_df = slice_df.drop_duplicates().reset_index(drop=True)
-        merge_fields = lookup_fields.copy()
-        for field in lookup_fields[:]:
-            if is_datetime64_any_dtype(slice_df[field]):
-                print(
-                    f"Converting {field} (dtype={slice_df[field].dtype}) to int date_id"
-                )
-                # Преобразуем дату в int в формате YYYYMMDD
-                # slice_df[field] = slice_df[field].apply(
-                #     lambda x:
-                #         int(x.strftime("%Y%m%d")) if pd.notnull(x) else None)
-                slice_df[field] = slice_df[field].dt.strftime("%Y%m%d").astype(int)
-                # Убираем преобразованное поле из списка целевых полей
-                lookup_fields.remove(field)
-        if not len(lookup_fields):
-            df = df.merge(
-                slice_df,
-                on=merge_fields,
-                how="left",
-                suffixes=("", "_id"),
-            )
-            df = df.drop(columns=target_fields)
-            return df
-        t_fields = list(self.mapping[field]["db_field"] for field in target_fields)
-        l_fields = list(self.mapping[field]["db_field"] for field in lookup_fields)
-        rename_map = dict(zip(target_fields, t_fields))
-        slice_df = slice_df.rename(columns=rename_map)
-        # print(type(l_fields))
-        # for field in l_fields:
-        # print(f"\t -- {field} ({type(field)})")
-
-        params = self.get_query_params(
-            df=slice_df,
-            fields=l_fields,
+        return DimensionStep(
+            table=step.table,
+            lookup_fields=step.lookup_fields,
+            target_fields=target_fields,
+            key_col=step.key_col or self.dimensions[step.table]["id"],
+            custom_col=step.custom_col,
         )
 
-        query = f"""
-            SELECT {key_col}, {params["columns"]}
-            FROM {table}
-            WHERE ({params["columns"]}) IN ({params["placeholders"]})
+    def _dimension_slice(self, df: pd.DataFrame, step: DimensionStep):
         """
+            Возвращает поля поиска в БД и уникальные значения `target_fields`
+            с именами полей БД, разделённые на найденные в кэше
+            (`key_col` + поля поиска) и остальные.
+        """
+        t_fields = [self.mapping[field]["db_field"] for field in step.target_fields]
+        l_fields = [self.mapping[field]["db_field"] for field in step.lookup_fields]
+        slice_df = (
+            df[step.target_fields]
+            .drop_duplicates()
+            .set_axis(t_fields, axis=1)
+            .reset_index(drop=True)
+        )
+        cached_df, missed_df = self._split_cached(slice_df, step.table, l_fields, step.key_col)
+        return l_fields, cached_df, missed_df
 
-        # Выполняем запрос
+    def _select_on_new_connection(
+        self,
+        df: pd.DataFrame,
+        step: DimensionStep,
+    ) -> pd.DataFrame:
+        """Поиск существующих ключей измерения на отдельном соединении пула"""
+        l_fields = [self.mapping[field]["db_field"] for field in step.lookup_fields]
         with self.engine.connect() as conn:
-            existing_rows = conn.execute(
-                text(query), params["params"]
-            ).fetchall()  # Должен вернуть список кортежей или словарей
-
-        # Формируем Фрейм  из полученных полей и идентификаторов
-
-        existing_df = pd.DataFrame(existing_rows)  # -> l_fieds + key_col
+            return self._select_existing(conn, df, step.table, l_fields, step.key_col)
 
-        # если нет записей в БД, то создаем пустой фрейм
-        if existing_df.empty:
-            existing_df = pd.DataFrame(columns=[key_col] + l_fields)
+    def _insert_dimension(
+        self,
+        df: pd.DataFrame,
+        table: str,
+        target_fields: List[str],
+        lookup_fields: List[str],
+        key_col: str,
+    ) -> pd.DataFrame:
+        """
+            Вставляет новые строки измерения под блокировкой таблицы
+            (`_lock_dimensions`): ключи, которые параллельная загрузка успела
+            вставить и зафиксировать, берутся из БД, остальные вставляются
+            под точкой сохранения (SAVEPOINT). Если вставка всё же нарушила
+            уникальный индекс (строки вставлены в обход блокировки),
+            транзакция откатывается только до точки сохранения и поиск
+            с вставкой повторяются.
+            Возвращает набор данных `key_col` + `target_fields`.
+        """
+        if df.empty:
+            return pd.DataFrame(columns=[key_col] + target_fields)
+        with self.connection() as conn:
+            self._lock_dimensions([table])
+            for attempt in range(2):
+                found_df = self._select_existing(conn, df, table, lookup_fields, key_col)
+                rest = df.merge(
+                    found_df[lookup_fields], on=lookup_fields, how="left", indicator=True
+                )
+                rest = rest[rest["_merge"] == "left_only"].drop(columns=["_merge"])
+                try:
+                    with conn.begin_nested():
+                        inserted = self._insert_returning(
+                            conn, rest, table, target_fields, key_col
+                        ) if not rest.empty else []
+                    break
+                # Через cursor psycopg2 (use_copy=False) ошибка не оборачивается
+                # в исключение SQLAlchemy
+                except (IntegrityError, PgIntegrityError) as e:
+                    if attempt:
+                        raise
+                    self.logger.warning(
+                        f"{table}: keys inserted concurrently, retrying: {getattr(e, 'orig', e)}"
+                    )
+        if not found_df.empty:
+            self.logger.info(f"{table}: {len(found_df)} keys inserted by a concurrent load")
+        inserted_df = pd.DataFrame(inserted, columns=[key_col] + target_fields)
+        self._cache_ids(found_df, table, lookup_fields, key_col)
+        self._cache_ids(inserted_df, table, lookup_fields, key_col)
+        return pd.concat([found_df, inserted_df], ignore_index=True)
 
-        try:
-            # Определяем, какие строки отсутствуют в БД
-            merged_df = slice_df.merge(
-                existing_df, on=l_fields, how="left", indicator=True
-            )
-        except Exception as e:
-            print(f"existing_df columns: \n {existing_df.columns}")
-            print(f"slice_df columns: \n {slice_df.columns}")
-            print(f"Error: {e}")
-            exit()
-
-        # Проверяем есть не найденные ID
-        new_rows = merged_df[merged_df["_merge"] == "left_only"]
-        new_rows = new_rows.drop(columns=["_merge"])
-
-        if not new_rows.empty:
-            # подготавливаем параметры для запроса
-
-            params = self.get_query_params(
-                df=new_rows,
-                fields=t_fields,
-            )
-            query = f"""
-                INSERT INTO {table} ({params['columns']})
-                VALUES {params['placeholders']}
-                RETURNING {key_col}, {params['columns']}
-            """
-            
-            # Вставляем данные и получаем идентификаторы новых строк
+    def _lock_dimensions(self, tables: List[str]) -> None:
+        """
+            Блокирует таблицы измерений до конца транзакции
+            (`pg_advisory_xact_lock`), чтобы параллельные загрузки не вставили
+            одни и те же ключи: уникальных индексов нет у dim_location, а NULL
+            в полях ключа и поиск по части полей (dim_staff) индекс не ловит.
+            Таблицы блокируются по порядку имён; таблица, которую план
+            заблокирует позже уже взятых (например, измерение таблицы связи),
+            может привести к deadlock, тогда Postgres прервёт одну из загрузок.
+        """
+        tables = sorted(set(tables) - self._locked)
+        if not tables:
+            return
+        # Вне транзакции `connection` блокировка снимается при COMMIT этого вызова
+        in_transaction = self._conn is not None
+        with self.connection() as conn:
+            for table in tables:
+                conn.execute(
+                    text("SELECT pg_advisory_xact_lock(hashtext('etl.dimension'), hashtext(:table))"),
+                    {"table": table},
+                )
+        if in_transaction:
+            self._locked.update(tables)
 
-            try:
-                with self.engine.connect() as conn:
-                    with conn.begin():
-                        new_ids = conn.execute(text(query), params["params"]).fetchall()
-            except DataError as e:
-                print(f"Error inserting data: {e}")
-                print(f"Parameters: {params["params"]}")
-                raise e
-            df_new_ids = pd.DataFrame(new_ids, columns=[key_col] + t_fields)
-            existing_df = pd.concat([existing_df, df_new_ids], ignore_index=True)
-            # Соединяем два датафрейма
-        df_with_ids = df.merge(
-            existing_df, right_on=l_fields, left_on=lookup_fields, how="left"
+    def _split_cached(
+        self,
+        df: pd.DataFrame,
+        table: str,
+        lookup_fields: List[str],
+        key_col: str,
+    ):
+        """
+            Делит набор данных на ключи, идентификаторы которых есть в кэше
+            (возвращаются как `key_col` + `lookup_fields`), и остальные строки.
+        """
+        if self.dim_cache is None or df.empty:
+            return pd.DataFrame(columns=[key_col] + lookup_fields), df
+        keys = df[lookup_fields].drop_duplicates()
+        ids = self.dim_cache.get_many(
+            table, lookup_fields, get_row_tuples(keys, lookup_fields)
         )
+        ids = pd.Series(ids, index=keys.index, dtype=object)
+        hits = ids.notna()
+        cached_df = keys[hits].copy()
+        cached_df.insert(0, key_col, ids[hits].astype(int))
+        missed_df = df.merge(keys[~hits], on=lookup_fields, how="inner")
+        return cached_df, missed_df
 
-        columns_for_drop = [
-            col for col in set(t_fields + target_fields) if col in df_with_ids.columns
-        ]
-
-        df = df_with_ids.drop(columns=columns_for_drop)
-        if custom_col:
-            df = df.rename(columns={key_col: custom_col})
-        return df
-
-    def get_query_params(
+    def _cache_ids(
         self,
         df: pd.DataFrame,
-        fields: List[str],
-    ):
-        """Фнкция генерирует словарь содержащий:
-        - строки со списком полей для запроса,
-        - Placeholder для запроса в котором список кортежей через запятую 
-        - словарь с параметрами для плейсхолдера
-        
+        table: str,
+        lookup_fields: List[str],
+        key_col: str,
+    ) -> None:
+        """
+            Запоминает идентификаторы найденных или вставленных строк.
+            Внутри транзакции они откладываются до COMMIT (см. `connection`)
+        """
+        if self.dim_cache is None or df.empty:
+            return
+        items = list(zip(get_row_tuples(df, lookup_fields), df[key_col].tolist()))
+        if self._conn is not None:
+            self._staged_ids.append((table, lookup_fields, items))
+        else:
+            self.dim_cache.put_many(table, lookup_fields, items)
 
-        Args:
-            df (pd.DataFrame): Набор данных на основе которого генерируется плейсхолдер и словарь параметров
-            fields (List[str]): Список полей на основе которых должен быть список.
-
-        Returns:
-            Dict[str: Any]: словарь содержащий:
-        - строки со списком полей для запроса 
-        >>> "field_1, field_2, ... field_n"
-        - Placeholder для запроса в котором список кортежей через запятую
-        >>> [
-        >>>     (:val_0_0, :val_0_1, :val_0_2, :val_0_3,),
-        >>>     (:val_1_0, :val_1_1, :val_1_2, :val_1_3,),
-        >>>     ....
-        >>>     (:val_n_0, :val_n_1, :val_n_2, :val_n_3,)
-        >>> ]
-        - словарь с параметрами для плейсхолдера
-        >>>    {
-        >>>        "val_0_0": "value",
-        >>>        "val_0_1": "value",
-        >>>        "val_0_2": "value",
-        >>>        "val_0_3": "value",
-        >>>        ...,
-        >>>        "val_n_n": "value"
-        >>>    }
-        """
-        # Подготовка параметров для запроса
-        param_dict = {}
-        placeholders_parts = []
-
-        for i, (_, row) in enumerate(df.iterrows()):
-            row_placeholders = []
-            for j, (col) in enumerate(fields):
-                param_name = f"val_{i}_{j}"
-                # Преобразуем другие типы в типы python
-                value = row[col]
-                if hasattr(value, "item"):
-                    value = value.item()
-                param_dict[param_name] = value
-                row_placeholders.append(f":{param_name}")
-            placeholders_parts.append(f"({', '.join(row_placeholders)})")
-        placeholders = ", ".join(placeholders_parts)
-        columns_str = ", ".join(fields)
-        return {
-            "params": param_dict,
-            "placeholders": placeholders,
-            "columns": columns_str,
-        }
+    def dim_lookup_keys(self) -> List[tuple]:
+        """
+            Ключи, по которым планы загрузки ищут измерения: таблица,
+            поля поиска (имена полей БД) и идентификатор. Для шагов
+            измерений и таблиц связи всех activity.
+        """
+        keys = []
+        for plan in self.plans.values():
+            for step in plan.dimensions:
+                l_fields = [self.mapping[field]["db_field"] for field in step.lookup_fields]
+                keys.append((step.table, tuple(l_fields), step.key_col))
+            for bridge in plan.bridges:
+                keys.append((bridge.dimension, tuple(bridge.dimension_fields), bridge.key_col))
+        return list(dict.fromkeys(keys))
+
+    def warm_dim_cache(self, tables: List[str] = None) -> None:
+        """
+            Заполняет кэш измерений всеми строками таблиц измерений
+            по тем же полям, по которым их ищут планы загрузки
+            (`dim_lookup_keys`). Кэш общий для процесса, поэтому каждый
+            ключ прогревается один раз.
+            Args:
+                tables: List[str] - список таблиц, по умолчанию все измерения планов
+        """
+        if self.dim_cache is None:
+            return
+        for table, fields, key_col in self.dim_lookup_keys():
+            if tables and table not in tables:
+                continue
+            # Порядок полей кэшу не важен (см. DimensionCache)
+            warm_key = (table, tuple(sorted(fields)))
+            if warm_key in self.dim_cache.warmed:
+                continue
+            try:
+                with self.connection() as conn:
+                    rows = conn.execute(
+                        text(f"SELECT {key_col}, {', '.join(fields)} FROM {table}")
+                    ).fetchall()
+            except Exception as e:
+                self.logger.warning(f"Не удалось прогреть кэш {table}: {e}")
+                continue
+            self.dim_cache.put_many(
+                table, list(fields), ((tuple(row[1:]), row[0]) for row in rows)
+            )
+            self.dim_cache.warmed.add(warm_key)
+            self.logger.info(f"Кэш {table} {list(fields)} прогрет: {len(rows)} ключей")
+
+    def check_date_ids(self, df: pd.DataFrame, columns: List[str]) -> None:
+        """
+            Проверяет, что ключи дат в столбцах `columns` попадают
+            в диапазон date_id таблицы dim_date. Пустые даты допускаются.
+            Raises:
+                ValueError: если есть даты вне диапазона dim_date
+        """
+        if self._date_id_range is None:
+            with self.connection() as conn:
+                self._date_id_range = tuple(conn.execute(
+                    text("SELECT min(date_id), max(date_id) FROM dim_date")
+                ).one())
+        low, high = self._date_id_range
+        for column in columns:
+            date_ids = df[column].dropna()
+            if date_ids.empty:
+                continue
+            if low is None:
+                raise ValueError(f"{column}: dim_date is empty")
+            outside = date_ids[(date_ids < low) | (date_ids > high)]
+            if not outside.empty:
+                raise ValueError(
+                    f"{column}: {len(outside)} dates outside dim_date "
+                    f"[{low}, {high}], e.g. {sorted(map(int, outside.unique()))[:5]}"
+                )
+
+    def log_dim_cache_stats(self) -> None:
+        """Пишет в лог попадания/промахи кэша измерений и обнуляет счётчики"""
+        if self.dim_cache is None:
+            return
+        for table, stats in self.dim_cache.stats().items():
+            self.logger.info(
+                f"dim cache {table}: hits={stats['hits']}, misses={stats['misses']}"
+            )
+        self.dim_cache.reset_stats()
 
     def bulk_select(
         self, df: pd.DataFrame, table: str, lookup_fields: List[str], key_col: str
@@ -349,18 +791,64 @@ class DWHModel:
                 lookup_fields: List[str] - список столбцов из набора данных в которых содержатся данные
                 key_col: str = Поле которое нужно нойти по соответствующим данным
         """
-        params = self.get_query_params(
-            df=df, fields=lookup_fields
-        )
+        with self.connection() as conn:
+            return self._select_existing(conn, df, table, lookup_fields, key_col)
+
+    def _select_existing(
+        self,
+        conn,
+        df: pd.DataFrame,
+        table: str,
+        lookup_fields: List[str],
+        key_col: str,
+    ) -> pd.DataFrame:
+        """
+            Ищет в таблице `table` строки с уникальными значениями `lookup_fields`
+            из набора данных. Ключи разбиваются на порции по `self.lookup_chunk_size`
+            строк, все порции выполняются на одном соединении, результаты объединяются.
+            Возвращает набор данных из столбцов `key_col` + `lookup_fields`.
+        """
+        keys = df[lookup_fields].drop_duplicates()
+        if keys.empty:
+            return pd.DataFrame(columns=[key_col] + lookup_fields)
+        types = self._column_types(conn, table)
+        columns = ", ".join(lookup_fields)
+        # Ключи передаются кортежами строк: psycopg2 подставляет их в VALUES
+        # страницами по `lookup_chunk_size` и собирает результат всех страниц.
+        # Значения приводятся к типам столбцов таблицы, поэтому соединение
+        # с VALUES выполняется как hash join, а не перебором списка IN
+        template = "(" + ", ".join(f"%s::{types[field]}" for field in lookup_fields) + ")"
+        match = " AND ".join(f"t.{field} = v.{field}" for field in lookup_fields)
         query = f"""
-            SELECT {key_col}, {params["columns"]}
-            FROM {table}
-            WHERE ({params["columns"]}) IN ({params["placeholders"]})
+            SELECT t.{key_col}, {", ".join(f"t.{field}" for field in lookup_fields)}
+            FROM {table} t
+            JOIN (VALUES %s) AS v ({columns}) ON {match}
         """
-        with self.engine.connect() as conn:
-            result = conn.execute(text(query), params["params"]).fetchall()
-        new_df = pd.DataFrame(result, columns=[key_col] + lookup_fields)
-        return new_df
+        with conn.connection.dbapi_connection.cursor() as cursor:
+            result = execute_values(
+                cursor,
+                query,
+                get_row_tuples(keys, lookup_fields),
+                template=template,
+                page_size=self.lookup_chunk_size,
+                fetch=True,
+            )
+        return pd.DataFrame(result, columns=[key_col] + lookup_fields)
+
+    def _column_types(self, conn, table: str) -> Dict[str, str]:
+        """Типы столбцов таблицы (`format_type`), читаются из БД один раз"""
+        types = self._table_types.get(table)
+        if types is None:
+            rows = conn.execute(
+                text("""
+                    SELECT attname, format_type(atttypid, atttypmod)
+                    FROM pg_attribute
+                    WHERE attrelid = CAST(:table AS regclass) AND attnum > 0 AND NOT attisdropped
+                """),
+                {"table": table},
+            ).fetchall()
+            types = self._table_types[table] = dict(rows)
+        return types
 
     def bulk_insert(
         self,
@@ -381,373 +869,280 @@ class DWHModel:
         """
         if df.empty:
             return pd.DataFrame(columns=[key_col] + target_fields)
-        params = self.get_query_params(
-            df=df, fields=target_fields
-        )
-        if key_col:
-            query = f"""
-                INSERT INTO {table} ({params['columns']})
-                VALUES {params['placeholders']}
-                RETURNING {key_col}, {params['columns']}
-            """
-        else:
-            query = f"""
-                INSERT INTO {table} ({params['columns']})
-                VALUES {params['placeholders']}
-                RETURNING {params['columns']}
-            """
-        with self.engine.connect() as conn:
-            result = conn.execute(text(query), params["params"]).fetchall()
-            conn.commit()
+        with self.connection() as conn:
+            result = self._insert_returning(conn, df, table, target_fields, key_col)
         df_columns = ([key_col] + target_fields) if key_col else target_fields
         new_df = pd.DataFrame(result, columns=df_columns)
         return new_df
 
-    def load_events_facts(self, df: pd.DataFrame):
-        # Преобразуем измерение dim_location в location_id
-        p_df = self.process_dims(
-            df=df,
-            table="dim_location",
-            lookup_fields=["settlement", "municipality", "region"],
-            target_fields=["settlement", "municipality", "region"],
-            key_col="location_id",
-        )
-        # Преобразуеми измерение dim_audience в audience_id(Целевая Аудитория)
-        p_df = self.process_dims(
-            df=p_df,
-            table="dim_audience",
-            lookup_fields=["age_group", "social_group"],
-            target_fields=["age_group", "social_group"],
-            key_col="audience_id",
-        )
-        # Преобразуем измерение dim_event["event_type", "event_format", "event_topic"] в location_id
-        p_df = self.process_dims(
-            df=p_df,
-            table="dim_event",
-            lookup_fields=["event_type", "event_format", "event_topic"],
-            target_fields=["event_type", "event_format", "event_topic"],
-            key_col="event_id",
-        )
-        # Преобразуеим измерение dim_staff ["organizer_name", "department", "personInCharge"] в staff_id(Организатор)
-        p_df = self.process_dims(
-            df=p_df,
-            table="dim_staff",
-            lookup_fields=["organizer_name", "department", "personInCharge"],
-            target_fields=["organizer_name", "department", "personInCharge"],
-            key_col="staff_id",
-            custom_col="organizer_id",
-        )
-        # Преобразуеми измерение dim_partner в partner_id
-        p_df = self.process_dims(
-            df=p_df,
-            table="dim_partner",
-            lookup_fields=["partner_name", "partner_type"],
-            target_fields=["partner_name", "partner_type"],
-            key_col="partner_id",
-        )
-        # Преобразуем дату в числоваой формат так как он и есть идентификатор
-        p_df["date"] = p_df["date"].apply(
-            lambda field: int(field.strftime("%Y%m%d")) if pd.notnull(field) else None
-        )
+    def _insert_returning(
+        self,
+        conn,
+        df: pd.DataFrame,
+        table: str,
+        target_fields: List[str],
+        key_col: str,
+    ) -> List:
+        """
+            Вставляет строки набора данных в таблицу `table` в рамках
+            открытой транзакции соединения `conn` и возвращает вставленные строки
+            (`key_col` + `target_fields`, если `key_col` задан).
+            В зависимости от `self.use_copy` данные идут либо через
+            `COPY` во временную таблицу, либо через `INSERT ... VALUES`
+            страницами по `self.insert_page_size` строк.
+        """
+        columns = ", ".join(target_fields)
+        returning = f"{key_col}, {columns}" if key_col else columns
+        if not self.use_copy:
+            # Строки передаются кортежами, psycopg2 сам разбивает их на
+            # страницы и собирает результат RETURNING со всех страниц
+            with conn.connection.dbapi_connection.cursor() as cursor:
+                return execute_values(
+                    cursor,
+                    f"INSERT INTO {table} ({columns}) VALUES %s RETURNING {returning}",
+                    get_row_tuples(df, target_fields),
+                    page_size=self.insert_page_size,
+                    fetch=True,
+                )
 
-        # Создаём для каждого волонтера из списка отдельную запись
-        volunteers = []
-        # указываем какие столбцы не будут учитываться при сопоставлении
-        excluded_cols = ["volunteers", "volunteers_type"] 
-        # Генерируем список по которому будет проводится сопоставление
-        merge_columns = [
-            col for col in p_df.columns if col not in excluded_cols
-            ] 
-        for _, row in p_df.iterrows():
-            _volunteers = row["volunteers"].split(", ")
-            for volunteer in _volunteers:
-                record = {
-                    "name": re.sub(r"[^а-яА-ЯёЁa-zA-Z\s]", "", volunteer).strip(),
-                    "type": re.sub(
-                        r"[^а-яА-ЯёЁa-zA-Z\s]", "", row["volunteers_type"]
-                    ).strip(),
-                }
-                for col in merge_columns:
-                    record[col] = row[col]
-                volunteers.append(record)
-        df_volunteers = pd.DataFrame(volunteers)
-        # Вставляем данные в таблицу фактов без данных о волонтерах
-        fact_id = self.load_to_fact_table(
-            p_df[merge_columns],
-            "fact_events",
-            lookup_fields=[
-                "date",
-                "location_id",
-                "event_id",
-                "audience_id",
-            ],
-        )
-        # Набор данных волонтеры состоит и полей name, type fact_id.columns
-        df_volunteers = df_volunteers.merge(
-            fact_id,
-            on=merge_columns,
-            how="left",
-        )
-        # Выбираем ID
-        volunteers_with_id = self.bulk_select(
-            df_volunteers[["name", "type"]],
-            "dim_staff",
-            lookup_fields=["name", "type"],
-            key_col="staff_id",
-        )
-        self.logger.info(f"Volunteeres in db {volunteers_with_id.count()}")
-        # volunteers_with_id вернёт datafrem c volunteer_id, name, type
-
-        # Добовляем найденных волонтеров в общий датафрейм
-        df_volunteers = pd.merge(
-            left=df_volunteers,
-            right=volunteers_with_id,
-            on=["name", "type"],
-            how="left",
-        )
+        stage = self._copy_to_stage(conn, df, table, target_fields)
+        query = f"""
+            INSERT INTO {table} ({columns})
+            SELECT {columns} FROM {stage}
+            RETURNING {returning}
+        """
+        return conn.execute(text(query)).fetchall()
 
-        # Вставляем волонтеров которых нет в базе
-        vol_for_insert = (
-            df_volunteers[df_volunteers["staff_id"].isna()][["name", "type"]]
-            .drop_duplicates()
-        )
-        print(f"Volunteeres to insert {vol_for_insert.head()}")
-        inserted_volunteers = self.bulk_insert(
-                df=vol_for_insert,
-                table="dim_staff",
-                target_fields=["name", "type"],
-                key_col="staff_id",
+    def _copy_to_stage(
+        self,
+        conn,
+        df: pd.DataFrame,
+        table: str,
+        target_fields: List[str],
+    ) -> str:
+        """
+            Загружает столбцы `target_fields` через `COPY` во временную таблицу
+            с теми же типами колонок, что и у `table`. Таблица удаляется
+            при COMMIT. Возвращает имя временной таблицы.
+        """
+        columns = ", ".join(target_fields)
+        stage = f"stage_{table}"
+        conn.execute(text(f"DROP TABLE IF EXISTS {stage}"))
+        conn.execute(text(
+            f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS "
+            f"SELECT {columns} FROM {table} WITH NO DATA"
+        ))
+        buffer = to_copy_buffer(df[target_fields])
+        with conn.connection.dbapi_connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {stage} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                buffer,
             )
-        print(f"inserted_volunteers {inserted_volunteers.head()}")
-
-        # Объединяем волонтеров которых нет в базе с теми которые были вставленны
-        # Устанавливаем в качестве индекса одинаковые поля
-        df_volunteers.set_index(["name", "type"], inplace=True)
-        inserted_volunteers.set_index(["name", "type"], inplace=True)
-        # Выбираем столбец с сериями
-        new_id_map = inserted_volunteers["staff_id"]
-        df_volunteers.fillna({"staff_id": new_id_map}, inplace=True)
-        df_volunteers.reset_index(inplace=True)
-
-        if df_volunteers["staff_id"].isna().any():
-            self.logger.warning(f"Некотррых волонтеров не удалось вставить")
-        vol_in_events = (
-            df_volunteers[["staff_id", "fact_event_id"]]
-            .rename(columns={
-                "staff_id": "volunteer_id",
-                "fact_event_id": "fact_event_id",
-            })
-        )
+        return stage
 
-        missing_mask = vol_in_events['fact_event_id'].isna()
-        if missing_mask.any():
-            raise Exception()
-        missing_mask = vol_in_events['volunteer_id'].isna()
-        if missing_mask.any():
-            raise Exception()
-        self.bulk_insert(
-            df=vol_in_events,
-            table="volunteers_in_events",
-            target_fields=["volunteer_id", "fact_event_id"],
-            key_col="id",
+    def _upsert_returning(
+        self,
+        conn,
+        df: pd.DataFrame,
+        table: str,
+        target_fields: List[str],
+        key_col: str,
+        unique_key: List[str],
+    ) -> List:
+        """
+            Вставляет строки через временную таблицу с `ON CONFLICT (unique_key)`
+            и возвращает `key_col` + `unique_key` для всех строк набора:
+            вставленных, обновлённых (режим "update") и уже существовавших
+            (режим "nothing"). Ключи строк набора должны быть уникальны
+            (см. `upsert_facts`), иначе Postgres не даст обновить строку дважды.
+        """
+        stage = self._copy_to_stage(conn, df, table, target_fields)
+        columns = ", ".join(target_fields)
+        key = ", ".join(unique_key)
+        returning = f"{key_col}, {key}"
+        updates = [field for field in target_fields if field not in unique_key]
+        if self.fact_upsert == "update" and updates:
+            query = f"""
+                INSERT INTO {table} ({columns})
+                SELECT {columns} FROM {stage}
+                ON CONFLICT ({key}) DO UPDATE
+                SET {", ".join(f"{field} = EXCLUDED.{field}" for field in updates)}
+                RETURNING {returning}
+            """
+            return conn.execute(text(query)).fetchall()
+        # DO NOTHING не возвращает существующие строки, поэтому идентификаторы
+        # всех строк набора выбираются соединением с таблицей отдельным
+        # запросом после вставки. В READ COMMITTED у него свой снимок: он видит
+        # и строки, которые параллельная транзакция зафиксировала, пока
+        # вставка ждала её на конфликте ключа, - в снимке самой вставки их нет.
+        # Ключи сравниваются текстом записи ROW(...): NULL в нём равен NULL,
+        # как в индексе NULLS NOT DISTINCT, и соединение остаётся hash join
+        # для полей любого типа
+        conn.execute(text(f"""
+            INSERT INTO {table} ({columns})
+            SELECT {columns} FROM {stage}
+            ON CONFLICT ({key}) DO NOTHING
+        """))
+        match = (
+            f"ROW({', '.join(f't.{field}' for field in unique_key)})::text"
+            f" = ROW({', '.join(f's.{field}' for field in unique_key)})::text"
         )
-        return fact_id
-
-    def load_im_placements_facts(self, df: pd.DataFrame) -> pd.DataFrame:
-        # Преобразуем измерение dim_location в location_id
-        temp_df = self.process_dims(
-            df=df,
-            table="dim_location",
-            lookup_fields=["settlement", "municipality", "region"],
-            target_fields=["settlement", "municipality", "region"],
-            key_col="location_id",
+        query = f"""
+            SELECT t.{key_col}, {", ".join(f"t.{field}" for field in unique_key)}
+            FROM {table} t
+            JOIN {stage} s ON {match}
+        """
+        return conn.execute(text(query)).fetchall()
+
+    def compile_plan(self, plan: LoadPlan) -> LoadPlan:
+        """
+            Проверяет план загрузки по schema.yaml и mapping.yaml и заполняет
+            значения шагов по умолчанию. Выполняется один раз при создании модели,
+            ошибка в activities.yaml обнаруживается до загрузки отчётов.
+        """
+        if plan.fact_table not in self.facts:
+            raise ValueError(f"Unknown fact table in activities.yaml: {plan.fact_table}")
+        for bridge in plan.bridges:
+            if bridge.table not in self.facts:
+                raise ValueError(f"Unknown bridge table in activities.yaml: {bridge.table}")
+            if bridge.list_field not in bridge.dimension_fields.values():
+                raise ValueError(
+                    f"{bridge.table}: list_field {bridge.list_field} is not in dimension_fields"
+                )
+        return LoadPlan(
+            fact_table=plan.fact_table,
+            dimensions=[self._complete_step(step) for step in plan.dimensions],
+            date_fields=plan.date_fields,
+            name=plan.name,
+            defaults=plan.defaults,
+            fallbacks=plan.fallbacks,
+            random_dates=plan.random_dates,
+            bridges=plan.bridges,
         )
+
+    def fill_missing_fields(self, df: pd.DataFrame, plan: LoadPlan) -> pd.DataFrame:
+        """
+            Добавляет поля, которых нет в отчёте: значения по умолчанию,
+            значения других полей и случайные даты из плана
+        """
+        fields = [*plan.defaults, *plan.fallbacks, *plan.random_dates]
+        if all(name in df.columns for name in fields):
+            return df
+        df = df.copy()
+        for name, value in plan.defaults.items():
+            if name not in df.columns:
+                df[name] = value
+        for name, source in plan.fallbacks.items():
+            if name not in df.columns:
+                df[name] = df[source]
+        for name, (start, end) in plan.random_dates.items():
+            if name not in df.columns:
+                start = datetime.strptime(start, "%Y-%m-%d").date()
+                end = datetime.strptime(end, "%Y-%m-%d").date()
+                df[name] = [get_random_date(start, end) for _ in range(len(df))]
+        return df
+
+    def prepare_facts(self, df: pd.DataFrame, plan: LoadPlan) -> pd.DataFrame:
+        """
+            Заменяет поля измерений плана идентификаторами, а даты -
+            ключами dim_date
+        """
+        p_df = self.resolve_dimensions(df, plan.dimensions)
         # Преобразуем дату в числоваой формат так как он и есть идентификатор
-        temp_df["placement_date"] = temp_df["placement_date"].apply(
-            lambda field: int(field.strftime("%Y%m%d")) if pd.notnull(field) else None
-        )
-        # Преобразуем измерение Информационные материалы в info_mat_id
-        temp_df = self.process_dims(
-            df=temp_df,
-            table="dim_info_materials",
-            lookup_fields=["im_name", "im_type", "im_topic", "im_format"],
-            target_fields=["im_name", "im_type", "im_topic", "im_format"],
-            key_col="info_materials_id",
-            custom_col="info_mat_id",
-        )
-        # Преобразуем измерение dim_placement_point в placement_point_id
-        temp_df = self.process_dims(
-            df=temp_df,
-            table="dim_placement_point",
-            lookup_fields=["pp_name", "pp_type"],
-            target_fields=["pp_name", "pp_type"],
-            key_col="placement_point_id",
-        )
-        # Преобразуеми измерение dim_audience в audience_id(Целевая Аудитория)
-        temp_df = self.process_dims(
-            df=temp_df,
-            table="dim_audience",
-            lookup_fields=["age_group", "social_group"],
-            target_fields=["age_group", "social_group"],
-            key_col="audience_id",
-        )
-        # Преобразуеми измерение dim_partner в partner_id
-        temp_df = self.process_dims(
-            df=temp_df,
-            table="dim_partner",
-            lookup_fields=["partner_name", "partner_type"],
-            target_fields=["partner_name", "partner_type"],
-            key_col="partner_id",
-        )
-        # Преобразуеим измерение dim_staff в staff_id(Организатор)
-        temp_df = self.process_dims(
-            df=temp_df,
-            table="dim_staff",
-            lookup_fields=["organizer_name", "department", "personInCharge"],
-            target_fields=["organizer_name", "department", "personInCharge"],
-            key_col="staff_id",
-            custom_col="organizer_id",
-        )
+        for field in plan.date_fields:
+            p_df[field] = to_date_id(p_df[field])
+        self.check_date_ids(p_df, plan.date_fields)
+        return p_df
 
-        ids = self.load_to_fact_table(
-            temp_df,
-            "fact_im_placements",
-            [
-                "placement_date",
-                "info_mat_id",
-                "placement_point_id",
-            ],
-        )
-        return ids
-
-    def load_edu_integrations_facts(self, df: pd.DataFrame):
-        # Преобразуем измерение dim_location в location_id
-        temp_df = self.process_dims(
-            df=df,
-            table="dim_location",
-            lookup_fields=["region", "settlement", "municipality"],
-            target_fields=["region", "settlement", "municipality"],
-            key_col="location_id",
-        )
+    def execute_plan(self, df: pd.DataFrame, plan: LoadPlan) -> pd.DataFrame:
+        """
+            Загружает набор данных по плану: измерения, даты, таблица фактов
+            и таблицы связи. Возвращает загруженные факты с идентификаторами
+        """
+        df = self.fill_missing_fields(df, plan)
+        p_df = self.prepare_facts(df, plan).reset_index(drop=True)
+        # Поля списков таблиц связи не хранятся в таблице фактов
+        excluded = {name for bridge in plan.bridges for name in bridge.report_fields}
+        fact_columns = [col for col in p_df.columns if col not in excluded]
+        fact_ids = self.load_to_fact_table(p_df[fact_columns], plan.fact_table)
+        for bridge in plan.bridges:
+            self.load_bridge(p_df, fact_columns, fact_ids, plan.fact_table, bridge)
+        return fact_ids
 
-        # Преобразуеим измерение dim_organization в organization_id(Организатор)
-        temp_df = self.process_dims(
-            df=temp_df,
-            table="dim_organization",
-            lookup_fields=[
-                "edu_org_name",
-                "edu_org_type",
-            ],
-            target_fields=[
-                "edu_org_name",
-                "edu_org_type",
-            ],
-            key_col="organization_id",
-        )
+    def load_bridge(
+        self,
+        df: pd.DataFrame,
+        fact_columns: List[str],
+        fact_ids: pd.DataFrame,
+        fact_table: str,
+        bridge: BridgeStep,
+    ) -> None:
+        """
+            Загружает таблицу связи факта со значениями списка в ячейке отчёта.
+            Args:
+                df (pd.DataFrame): Набор данных с идентификаторами измерений
+                fact_columns (List[str]): Поля, по которым строки отчёта
+                    сопоставляются загруженным фактам
+                fact_ids (pd.DataFrame): Результат `load_to_fact_table`
+                fact_table (str): Таблица фактов
+                bridge (BridgeStep): Описание таблицы связи
+        """
+        fact_key = self.facts[fact_table]["id"]
+        # Для каждого значения списка отдельная запись с номером строки отчёта `row`
+        df_values = explode_list_values(df, bridge)
+        lookup_fields = list(bridge.dimension_fields)
 
-        # Выделим измерение образовательной програмы
-        if "edu_program_type" not in temp_df.columns:
-            temp_df["edu_program_type"] = "Обязательное образование"
-        temp_df = self.process_dims(
-            df=temp_df,
-            table="dim_edu_program",
-            lookup_fields=[
-                "edu_program_name",
-                "edu_program_type",
-            ],
-            target_fields=[
-                "edu_program_name",
-                "edu_program_type",
-            ],
-            key_col="edu_program_id",
-        )
-        if "teachers_finlit_trained_cnt" not in temp_df.columns:
-            temp_df["teachers_finlit_trained_cnt"] = temp_df[
-                "teachers_finlit_train_cnt"
-            ]
-        if "date" not in temp_df.columns:
-            from etl.tools import get_random_date
-            from datetime import datetime
-            temp_df['date'] = None
-            temp_df["date"] = temp_df["date"].apply(
-                lambda x: get_random_date(
-                    datetime.strptime("2022-01-01", "%Y-%m-%d").date(),
-                    datetime.strptime("2023-12-31", "%Y-%m-%d").date(),
-                )
-            )
-            
-        ids = self.load_to_fact_table(
-            temp_df,
-            "fact_edu_integrations",
-            [
-                "edu_program_id",
-                "organization_id",
-                "location_id",
-            ],
+        # Сопоставляем строкам отчёта идентификатор факта один раз на строку,
+        # а не на каждое значение списка, и переносим его значениям по `row`
+        row_facts = (
+            df[fact_columns]
+            .reset_index(names="row")
+            .merge(fact_ids[fact_columns + [fact_key]], on=fact_columns, how="left")
         )
-        return ids
-
-    def load_trainig_facts(self, df: pd.DataFrame):
-        # Get location dimensions id
-        #Принимает набор полей и заменияет его {key_col} 
-        # и возвращает новый датафрейм с  {key_col} вместо {target_fields}
-        temp_df = self.process_dims(
-            df=df,
-            table="dim_location",
-            lookup_fields=["settlement", "municipality", "region"],
-            target_fields=["settlement", "municipality", "region"],
-            key_col="location_id",
-        )
-        # Get staff dimension id
-        temp_df = self.process_dims(
-            df=temp_df,
-            table="dim_staff",
-            lookup_fields=["fullname", "participants_type", "participants_spec"],
-            target_fields=["fullname", "participants_type", "participants_spec"],
-            key_col="staff_id",
+        df_values = df_values.merge(row_facts[["row", fact_key]], on="row", how="left")
+
+        # Идентификаторы значений: из кэша, найденные в БД и вставленные
+        keys = df_values[lookup_fields].drop_duplicates()
+        cached, missed = self._split_cached(keys, bridge.dimension, lookup_fields, bridge.key_col)
+        found = self.bulk_select(
+            missed, bridge.dimension, lookup_fields=lookup_fields, key_col=bridge.key_col
         )
-        # Get organiztions ids
-        temp_df = self.process_dims(
-            df=temp_df,
-            table="dim_organization",
-            lookup_fields=["affiliation_org", "affiliation_org_type"],
-            target_fields=["affiliation_org", "affiliation_org_type"],
-            key_col="organization_id",
-            custom_col="affiliation_org_id",
+        self._cache_ids(found, bridge.dimension, lookup_fields, bridge.key_col)
+        new_keys = missed.merge(found[lookup_fields], on=lookup_fields, how="left", indicator=True)
+        new_keys = new_keys[new_keys["_merge"] == "left_only"].drop(columns=["_merge"])
+        inserted = self._insert_dimension(
+            df=new_keys,
+            table=bridge.dimension,
+            target_fields=lookup_fields,
+            lookup_fields=lookup_fields,
+            key_col=bridge.key_col,
         )
-        temp_df = self.process_dims(
-            df=temp_df,
-            table="dim_organization",
-            lookup_fields=["edu_org_name"],
-            target_fields=["edu_org_name"],
-            key_col="organization_id",
-            custom_col="training_provider_id",
+        self.logger.info(
+            f"{bridge.table}: {len(cached)} {bridge.dimension} rows cached, "
+            f"{len(found)} found, {len(inserted)} inserted"
         )
-        # get trainings programm
-        temp_df = self.process_dims(
-            df=temp_df,
-            table="dim_training_program",
-            lookup_fields=["training_program_name", "training_program_provider"],
-            target_fields=[
-                "training_program_name",
-                "training_program_provider",
-                "num_hours",
+        ids = pd.concat(
+            [
+                cached[[bridge.key_col] + lookup_fields],
+                found[[bridge.key_col] + lookup_fields],
+                inserted[[bridge.key_col] + lookup_fields],
             ],
-            key_col="training_program_id",
-        )
-        # Преобразуем дату в числоваой формат так как он и есть идентификатор
-        temp_df["start_date"] = temp_df["start_date"].apply(
-            lambda field: int(field.strftime("%Y%m%d")) if pd.notnull(field) else None
+            ignore_index=True,
         )
-        temp_df["end_date"] = temp_df["end_date"].apply(
-            lambda field: int(field.strftime("%Y%m%d")) if pd.notnull(field) else None
+        df_values = df_values.merge(ids, on=lookup_fields, how="left")
+        links = df_values[[bridge.key_col, fact_key]].rename(
+            columns={bridge.key_col: bridge.dim_col, fact_key: bridge.fact_col}
         )
-        #принимает датафрейм где все поля измерений заменены на идентификаторы 
-        # Проверяет по lookup_fields наличие записей в таблице что бы не дублировать
-        # недостающие записи вставляет
-        ids = self.load_to_fact_table(
-            df=temp_df,
-            table="fact_trainings",
-            lookup_fields=["start_date", "end_date", "location_id", "staff_id"],
-        )
-        return ids
+        if links.isna().any().any():
+            raise ValueError(f"{bridge.table}: rows without {bridge.dim_col} or {bridge.fact_col}")
+
+        unique_key = self.facts[bridge.table].get("unique_key")
+        if self.fact_upsert and unique_key:
+            self.upsert_facts(links, bridge.table, unique_key, self.facts[bridge.table]["id"])
+        else:
+            self.bulk_insert(
+                df=links,
+                table=bridge.table,
+                target_fields=[bridge.dim_col, bridge.fact_col],
+                key_col=self.facts[bridge.table]["id"],
+            )
@@ -1,5 +1,6 @@
 from .graph import (
     fetch_all_new_files,
+    fetch_new_file_groups,
     group_files_by_activity,
     emit_file_groups,
     download_and_combine_files,
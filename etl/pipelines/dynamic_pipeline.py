@@ -1,18 +1,6 @@
 from dagster import job, op, DynamicOut, DynamicOutput
 from etl.pipelines.ops import concat_files, standardize_columns, split_and_write, update_status
-import yaml
 from etl.models import MongoDB
-from etl.config import CONFIGS_DIR
-
-mongo = MongoDB()
-
-# ----------------------
-# Загружаем конфиг схемы
-# ----------------------
-with open(CONFIGS_DIR/"schema.yaml") as f:
-    SCHEMA = yaml.safe_load(f)
-with open(CONFIGS_DIR/"amapping.yaml") as f:
-    MAPPING = yaml.safe_load(f)
 
 
 # ----------------------
@@ -32,6 +20,8 @@ def get_new_files_by_activity():
  
     """
     
+    # Подключение создаётся при выполнении op, а не при импорте модуля
+    mongo = MongoDB()
     new_files = mongo.get_files_by_status("new") 
     # Функция возвращает генератор который возвращает словарь
     # {
@@ -62,17 +52,14 @@ def process_new_files():
     activity_files = get_new_files_by_activity()
 
     for files in activity_files:
-        activity_id = str(files[0]["activity_id"])
-        schema = SCHEMA[activity_id]
-
         # 1. Конкатенация файлов
         concat_result = concat_files(files)
 
-        # 2. Стандартизация заголовков
-        standardized = standardize_columns(concat_result, MAPPING)
+        # 2. Стандартизация заголовков (сопоставление берётся из реестра конфигов в op)
+        standardized = standardize_columns(concat_result)
 
-        # 3. Split на dim/fact и запись в DWH
-        processed_activities = split_and_write(standardized, schema)
+        # 3. Split на dim/fact и запись в DWH (схема берётся из реестра конфигов в op)
+        processed_activities = split_and_write(standardized)
 
         # 4. Обновление статуса файлов
         update_status(processed_activities)
\ No newline at end of file
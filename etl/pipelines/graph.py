@@ -1,5 +1,4 @@
 from typing import List, Dict, Tuple, Any
-import yaml
 import re
 from dagster import (
     op,
@@ -9,34 +8,46 @@ from dagster import (
     Definitions,
     OpExecutionContext,
     DynamicOut,
+    Field,
     Out,
     DynamicOutput,
     In,
     EnvVar,
     get_dagster_logger,
     in_process_executor,
+    multiprocess_executor,
 )  # noqa: TID252
 import pandas as pd
-from etl.tools import Mapping  # noqa:
-from etl.config import CONFIGS_DIR
+from etl.tools import Mapping, map_categories  # noqa:
+from etl.readers import ReportCache, ReportReader, compact_dtypes, get_category_fields
+from etl.config import (
+    CONFIGS,
+    ETL_EXECUTOR,
+    ETL_MAX_CONCURRENT,
+    ETL_DB_CONCURRENCY,
+    ETL_EXCEL_ENGINE,
+    ETL_PRUNE_UNMAPPED,
+    ETL_HEADERS_FILE,
+    ETL_GROUP_ON_SERVER,
+    ETL_REPORT_CACHE_DIR,
+    get_field_types,
+    get_header_index,
+)
 from etl.models import Meta as CustomMeta
+from etl.models.load_plan import parse_plans
 logger = get_dagster_logger()
 
 
 ###################################################
 
 # ----------------------
-# 1. Загружаем конфиг схемы
+# 1. Конфиги схемы и сопоставления полей читаются через реестр CONFIGS
+#    (etl.config) при первом обращении, а не при импорте модуля
 # ----------------------
-with open(CONFIGS_DIR/"schema.yaml", 'r', encoding='utf-8') as f:
-    SCHEMA = yaml.safe_load(f)
-    
-with open(CONFIGS_DIR/"mapping.yaml", 'r', encoding='utf-8') as mf:
-    MAPPING_SCHEMA = yaml.safe_load(mf)
-
-FIELDS_STD_SCHEMA = (
-    {key: MAPPING_SCHEMA[key]['matches'] for key, _ in MAPPING_SCHEMA.items()}
-    )
+
+# Теги для ограничения количества шагов, одновременно работающих с внешними системами
+DWH_TAGS = {"etl/target": "dwh"}
+S3_TAGS = {"etl/target": "s3"}
 
 
 # ==============================
@@ -44,9 +55,46 @@ FIELDS_STD_SCHEMA = (
 # ==============================
 
 
-@op(required_resource_keys={"mongo_client"})
+FETCH_CONFIG = {
+    "limit": Field(
+        int,
+        default_value=0,
+        description="Максимальное количество файлов за запуск, 0 - без ограничения",
+    ),
+    "batch_size": Field(
+        int,
+        default_value=1000,
+        description="Количество документов в одной порции курсора MongoDB",
+    ),
+    "lease_seconds": Field(
+        int,
+        default_value=3600,
+        description=(
+            "Срок аренды захваченных файлов. Если запуск не обновил их статус "
+            "за это время, файлы снова попадают в очередь"
+        ),
+    ),
+    "activity_id": Field(
+        Any,
+        default_value=None,
+        description="Обрабатывать только файлы этой activity, None - все",
+    ),
+}
+
+
+def lease_owner(context: OpExecutionContext) -> str:
+    """
+    Владелец аренды файлов запуска: run_id исходного запуска. Повторный
+    запуск с места сбоя получает новый run_id, но продолжает работать
+    с файлами, захваченными исходным запуском.
+    """
+    return context.dagster_run.root_run_id or context.run_id
+
+
+@op(required_resource_keys={"mongo_client"}, config_schema=FETCH_CONFIG)
 def fetch_all_new_files(context: OpExecutionContext) -> List[dict]:
-    """Запрашивает все записи со статусом "new"
+    """Захватывает записи со статусом "new" для текущего запуска и возвращает их.
+    Параллельные запуски получают непересекающиеся наборы файлов.
 
     Args:
         context (_type_): Контекст dagster
@@ -54,7 +102,17 @@ def fetch_all_new_files(context: OpExecutionContext) -> List[dict]:
         List[dict]: Возвращает список словарей содержащих пути к файлам
     """
     mongo = context.resources.mongo_client
-    files = mongo.get_files_by_status()
+    mongo.claim_files(
+        owner=lease_owner(context),
+        limit=context.op_config["limit"],
+        lease_seconds=context.op_config["lease_seconds"],
+        activity_id=context.op_config["activity_id"],
+    )
+    files = mongo.get_files_by_status(
+        status=mongo.CLAIMED_STATUS,
+        batch_size=context.op_config["batch_size"],
+        owner=lease_owner(context),
+    )
     """ `files` представляет собой список словарей вида
         >>> {
         >>>     "activity_id": int,
@@ -67,6 +125,38 @@ def fetch_all_new_files(context: OpExecutionContext) -> List[dict]:
     return files
 
 
+@op(
+    required_resource_keys={"mongo_client"},
+    config_schema={
+        "limit": FETCH_CONFIG["limit"],
+        "lease_seconds": FETCH_CONFIG["lease_seconds"],
+        "activity_id": FETCH_CONFIG["activity_id"],
+    },
+)
+def fetch_new_file_groups(context: OpExecutionContext) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Захватывает записи со статусом "new" для текущего запуска и возвращает их
+    сгруппированными по activity_id на стороне MongoDB. Используется вместо
+    fetch_all_new_files + group_files_by_activity при больших очередях файлов.
+    Возвращает словарь: {activity_id: [файл1, файл2, ...]}
+    """
+    mongo = context.resources.mongo_client
+    mongo.claim_files(
+        owner=lease_owner(context),
+        limit=context.op_config["limit"],
+        lease_seconds=context.op_config["lease_seconds"],
+        activity_id=context.op_config["activity_id"],
+    )
+    activity_groups = mongo.get_file_groups(
+        status=mongo.CLAIMED_STATUS, owner=lease_owner(context)
+    )
+    logger.info(
+        f"Found {sum(map(len, activity_groups.values()))} new files "
+        f"in {len(activity_groups)} activity groups"
+    )
+    return activity_groups
+
+
 @op
 def group_files_by_activity(
     context: OpExecutionContext,
@@ -99,12 +189,26 @@ def emit_file_groups(
         yield DynamicOutput(file_list, mapping_key=safe_key)
 
 
+def check_plan_fields(plan, columns) -> None:
+    """
+    Проверяет, что в отчёте есть поля, нужные плану загрузки activity.
+    Raises:
+        KeyError: в отчёте нет полей плана
+    """
+    if plan is None:
+        return
+    missing = plan.missing_fields(columns)
+    if missing:
+        raise KeyError(f"В отчёте нет полей {missing}")
+
+
 @op(
     out={
         "combined_df": Out(pd.DataFrame),
         "c_metadata": Out(List[CustomMeta])
     },
-    required_resource_keys={"s3_client"}
+    required_resource_keys={"s3_client"},
+    tags=S3_TAGS,
 )
 def download_and_combine_files(
     context: OpExecutionContext,
@@ -116,11 +220,41 @@ def download_and_combine_files(
     Использует: context.resources.s3_client
     """
     c_metadata = []
-    mapping = Mapping(FIELDS_STD_SCHEMA)
+    mapping = Mapping(get_header_index(), learned_path=ETL_HEADERS_FILE or None)
+    reader = ReportReader(
+        mapping,
+        field_types=get_field_types(),
+        engine=ETL_EXCEL_ENGINE,
+        prune_unmapped=ETL_PRUNE_UNMAPPED,
+    )
+    # Столбцы, без которых отчёт нельзя загрузить по плану его activity:
+    # неизвестные заголовки пропускаются, но опечатка в нужном поле
+    # отклоняет файл, а не загружает пустые значения
+    plans = CONFIGS.derived("activities.yaml", parse_plans)
     s3 = context.resources.s3_client
     dataframes = []
     logger.info(f"download_and_combine_files:\t {len(file_group)} files to process")
-    for file in file_group:
+    # Уже разобранные отчёты берём из кэша по ETag, скачиваем только остальные.
+    # Хэш mapping.yaml входит в ключ: после его правки отчёты разбираются заново
+    report_cache = (
+        ReportCache(ETL_REPORT_CACHE_DIR, CONFIGS.digest("mapping.yaml"), str(ETL_PRUNE_UNMAPPED))
+        if ETL_REPORT_CACHE_DIR else None
+    )
+    etags = {}
+    cached = {}
+    if report_cache is not None and report_cache.enabled:
+        etags = s3.get_etags(file["filename"] for file in file_group)
+        for i, file in enumerate(file_group):
+            df = report_cache.load(etags[file["filename"]])
+            if df is not None:
+                cached[i] = df
+        logger.info(f"download_and_combine_files:\t {len(cached)} files from report cache")
+    # Файлы скачиваются в фоне параллельно, пока разбираются предыдущие,
+    # и закрываются после разбора
+    downloads = s3.get_many(
+        [file["filename"] for i, file in enumerate(file_group) if i not in cached]
+    )
+    for i, file in enumerate(file_group):
         """file это словарь с ключами:
         >>> {
             >>>     "activity_id": int,
@@ -129,31 +263,41 @@ def download_and_combine_files(
             >>> }
         """
         try:
-            # Загружаем  файл из хранилища
-            df = pd.read_excel(s3.get(file["filename"]))
+            if i in cached:
+                df = cached.pop(i)
+                check_plan_fields(plans.get(str(file.get("activity_id"))), df.columns)
+            else:
+                _, body, error = next(downloads)
+                if error is not None:
+                    raise error
+                # Читаем заголовки, сопоставляем их через mapping.yaml
+                # и загружаем из файла только сопоставленные столбцы
+                headers = reader.read_header(body)
+                columns = reader.resolve_columns(headers)
+                check_plan_fields(plans.get(str(file.get("activity_id"))), columns.values())
+                df = reader.read(body, columns)
+                if report_cache is not None:
+                    report_cache.save(etags.get(file["filename"]), df)
             logger.info(f"download_and_combine_files:\t {file['filename']} loaded")
-        except Exception as e:
+        except KeyError as e:
             c_metadata.append(
                 CustomMeta(
                     document_id=file.get("document_id"),
                     status="error",
-                    reason=f"Не удалось загрузить файл {e}"
+                    reason=f"Не удалось стандартизировать имена заголовков отчёта. {e}"
                 )
             )
-            logger.error(f"download_and_combine_files:\t {file['filename']} not loaded")
+            logger.error(f"download_and_combine_files:\t {file['filename']} not renamed")
             continue
-        try:
-            df = df.rename(columns=mapping.get)
-            logger.info(f"download_and_combine_files:\t {file['filename']} renamed")
         except Exception as e:
             c_metadata.append(
                 CustomMeta(
                     document_id=file.get("document_id"),
                     status="error",
-                    reason=f"Не удалось стандартизировать имена заголовков отчёта. {e}"
+                    reason=f"Не удалось загрузить файл {e}"
                 )
             )
-            logger.error(f"download_and_combine_files:\t {file['filename']} not renamed")
+            logger.error(f"download_and_combine_files:\t {file['filename']} not loaded")
             continue
         dataframes.append(df)
         c_metadata.append(
@@ -163,10 +307,38 @@ def download_and_combine_files(
                 reason="None"
             )
         )
+    try:
+        # Запоминаем заголовки, найденные нечётким поиском, для следующих запусков
+        mapping.save_learned()
+    except OSError as e:
+        logger.warning(f"download_and_combine_files:\t learned headers not saved: {e}")
     if not dataframes:
         logger.error("download_and_combine_files:\t dataframes is empty")
         raise Exception("download_and_combine_files:\t dataframes is empty")
-    return pd.concat(dataframes, ignore_index=True), c_metadata
+    combined_df = pd.concat(dataframes, ignore_index=True)
+    memory_before = combined_df.memory_usage(deep=True).sum()
+    # Строковые поля измерений хранятся как category
+    combined_df = compact_dtypes(
+        combined_df, CONFIGS.derived("mapping.yaml", get_category_fields)
+    )
+    memory_after = combined_df.memory_usage(deep=True).sum()
+    logger.info(
+        f"download_and_combine_files:\t {len(combined_df)} rows, "
+        f"{memory_before / 2**20:.1f} MB -> {memory_after / 2**20:.1f} MB"
+    )
+    context.add_output_metadata(
+        {
+            "rows": len(combined_df),
+            "memory_mb_before": round(memory_before / 2**20, 2),
+            "memory_mb": round(memory_after / 2**20, 2),
+            "category_columns": [
+                col for col in combined_df.columns
+                if isinstance(combined_df[col].dtype, pd.CategoricalDtype)
+            ],
+        },
+        output_name="combined_df",
+    )
+    return combined_df, c_metadata
 
 
 @op
@@ -183,29 +355,66 @@ def clean_and_enrich(
     logger.info(f"clean_and_enrich:\t {len(combined_df)} rows to process")
     combined_df = combined_df.drop_duplicates()
     combined_df = combined_df.dropna(how="all")
-    combined_df["settlement"] = (
-                combined_df["settlement"]
-                .str.strip()
-                .str.replace(r'^[\w]+\.','', regex=True)
-                .str.strip()
+    # Для category очищаются только уникальные значения
+    combined_df["settlement"] = map_categories(
+        combined_df["settlement"],
+        lambda settlement: (
+            settlement
+            .str.strip()
+            .str.replace(r'^[\w]+\.','', regex=True)
+            .str.strip()
+        ),
     )
     return combined_df
 
 
-@op(required_resource_keys={"target_db"})
+@op(
+    required_resource_keys={"target_db", "mongo_client"},
+    config_schema={"lease_seconds": FETCH_CONFIG["lease_seconds"]},
+    tags=DWH_TAGS,
+)
 def load_dimensions_and_facts(
     context: OpExecutionContext, df: pd.DataFrame, c_meta: List[CustomMeta]
 ) -> Dict[str, Any]:
     """
     Загружает измерения и факты в целевую БД.
     Возвращает список _id исходных записей (как строки), которые были обработаны.
-    Использует: context.resources.target_db
+    Перед загрузкой продлевает аренду файлов группы: шаг мог долго ждать
+    своей очереди к DWH, а файлы с истёкшей арендой может захватить
+    другой запуск.
+    Использует: context.resources.target_db, context.resources.mongo_client
     """
     if df.empty:
         logger.error("load_dimensions_and_facts:\t df is empty")
         return {"c_meta": c_meta, "Writed_fats_count": 0}
     key = context.get_mapping_key()
     target_db = context.resources.target_db
+    if key not in target_db.plans:
+        # Отчёты без плана загрузки в activities.yaml помечаем ошибкой,
+        # а не обработанными: после добавления плана их можно загрузить заново
+        logger.error(f"load_dimensions_and_facts:\t no load plan for activity {key}")
+        c_meta = [
+            CustomMeta(
+                document_id=meta.document_id,
+                status="error",
+                reason=f"Нет плана загрузки для activity {key} в activities.yaml"
+            ) if meta.status == "processed" else meta
+            for meta in c_meta
+        ]
+        return {"c_meta": c_meta, "Writed_fats_count": 0}
+    document_ids = [meta.document_id for meta in c_meta]
+    extended = context.resources.mongo_client.extend_lease(
+        owner=lease_owner(context),
+        document_ids=document_ids,
+        lease_seconds=context.op_config["lease_seconds"],
+    )
+    if extended < len(document_ids):
+        # Часть файлов уже вернулась в очередь: загрузка группы
+        # продублировала бы их факты при следующей обработке
+        raise Exception(
+            f"load_dimensions_and_facts:\t lease lost for "
+            f"{len(document_ids) - extended} of {len(document_ids)} files"
+        )
     try:
         ids = target_db.dispatch(key, df)
     except Exception as e:
@@ -221,10 +430,23 @@ def load_dimensions_and_facts(
 def update_mongo_status(context: OpExecutionContext, processed_ids: Dict) -> None:
     """
     Обновляет статус записей в MongoDB на 'processed' (или другой).
+    Изменяются только файлы, аренда которых принадлежит текущему запуску.
     Использует: context.resources.mongo_client
     """
     mongo = context.resources.mongo_client
-    mongo.update_status(processed_ids['c_meta'])
+    c_meta = processed_ids['c_meta']
+    counts = mongo.update_status(c_meta, owner=lease_owner(context))
+    if counts["matched"] < len(c_meta):
+        logger.warning(
+            f"update_mongo_status:\t {len(c_meta) - counts['matched']} files "
+            f"no longer leased by run {lease_owner(context)}, status not changed"
+        )
+    logger.info(
+        f"update_mongo_status:\t matched {counts['matched']}, modified {counts['modified']}"
+    )
+    context.add_output_metadata(
+        {"matched_count": counts["matched"], "modified_count": counts["modified"]}
+    )
 
 
 # ==============================
@@ -246,7 +468,30 @@ def process_file_group(file_group: List[Dict[str, Any]]):
 # 4. JOB — основной pipeline
 # ==============================
 
-@job(executor_def=in_process_executor)
+if ETL_EXECUTOR == "in_process":
+    EXECUTOR = in_process_executor
+    EXECUTOR_CONFIG = None
+else:
+    # Ветки разных activity выполняются в отдельных процессах,
+    # но в DWH одновременно пишут не больше ETL_DB_CONCURRENCY шагов
+    EXECUTOR = multiprocess_executor
+    EXECUTOR_CONFIG = {
+        "execution": {
+            "config": {
+                "max_concurrent": ETL_MAX_CONCURRENT,
+                "tag_concurrency_limits": [
+                    {
+                        "key": "etl/target",
+                        "value": DWH_TAGS["etl/target"],
+                        "limit": ETL_DB_CONCURRENCY,
+                    },
+                ],
+            }
+        }
+    }
+
+
+@job(executor_def=EXECUTOR, config=EXECUTOR_CONFIG)
 def process_all_new_files():
     """
     Основной pipeline:
@@ -254,7 +499,10 @@ def process_all_new_files():
     2. Сгруппировать по activity
     3. Для каждой группы — запустить process_file_group параллельно
     """
-    files = fetch_all_new_files()
-    grouped = group_files_by_activity(files)
+    if ETL_GROUP_ON_SERVER:
+        grouped = fetch_new_file_groups()
+    else:
+        files = fetch_all_new_files()
+        grouped = group_files_by_activity(files)
     dynamic_groups = emit_file_groups(grouped)
     dynamic_groups.map(process_file_group)
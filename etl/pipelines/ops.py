@@ -3,6 +3,8 @@ import pandas as pd
 import json
 from models import Minio, MongoDB, DWHModel, Meta
 from tools import Mapping
+from readers import read_excel
+from config import get_header_index, get_schema
 
 minio_client = Minio()
 mongo_client = MongoDB()
@@ -35,7 +37,7 @@ def concat_files(file_list: list[dict]) -> tuple[pd.DataFrame, dict]:
     meta = []
     for file in file_list:
         try:
-            df = pd.read_excel(
+            df = read_excel(
                 minio_client.get_file(
                     file.get("filename", '')
                     )
@@ -65,15 +67,15 @@ def concat_files(file_list: list[dict]) -> tuple[pd.DataFrame, dict]:
 # Шаг 2: Стандартизация заголовков
 # ----------------------
 @op
-def standardize_columns(concat_result: tuple, mapping: dict) -> tuple[pd.DataFrame, list]:
+def standardize_columns(concat_result: tuple) -> tuple[pd.DataFrame, list]:
     """
     Применяем общий mapping для замены заголовков.
+    Словарь заголовков берётся из реестра конфигов при выполнении op.
     concat_result: (df, meta)
     params:
          concat_result: Кортеж из датафрейма и метаданных
-         mapping: словарь для замены заголовков
     """
-    meta_mapping = Mapping(mapping)
+    meta_mapping = Mapping(get_header_index())
     df, meta = concat_result
     df = df.rename(columns=[
         meta_mapping.get(key) for key in df.columns])
@@ -83,13 +85,14 @@ def standardize_columns(concat_result: tuple, mapping: dict) -> tuple[pd.DataFra
 # Шаг 3: Разделение на измерения и факты и запись в DWH
 # ----------------------
 @op
-def split_and_write(standardized_result: tuple, schema: dict):
+def split_and_write(standardized_result: tuple):
     """
     Для каждого activity берём подмножество колонок по схеме:
       - dimensions
       - facts
-    Записываем в DWH.
+    Записываем в DWH. Схема берётся из реестра конфигов при выполнении op.
     """
+    schema = get_schema()
     df, meta = standardized_result
     processed_activities = []
     for activity_id in set([m["activity_id"] for m in meta]):
@@ -0,0 +1,114 @@
+from hashlib import sha1
+from typing import Any, Dict, List
+from dagster import (
+    RunRequest,
+    SensorEvaluationContext,
+    SensorResult,
+    SkipReason,
+    sensor,
+)
+from etl.config import ETL_GROUP_ON_SERVER, ETL_SENSOR_INTERVAL, ETL_SENSOR_MODE
+from etl.pipelines.graph import EXECUTOR_CONFIG, process_all_new_files
+
+
+def group_by_activity(files: List[Dict[str, Any]]) -> Dict[Any, List[Dict[str, Any]]]:
+    """Группирует файлы формата MongoDB.get_files_by_status по activity_id"""
+    groups = {}
+    for file in files:
+        groups.setdefault(file["activity_id"], []).append(file)
+    return groups
+
+
+def build_run_requests(
+        groups: Dict[Any, List[Dict[str, Any]]],
+        tick_key: str = ""
+        ) -> List[RunRequest]:
+    """
+    Создаёт по одному запуску process_all_new_files на каждую activity.
+    Запуск захватывает новые файлы только своей activity.
+    `tick_key` отличает тики с теми же файлами: файл, возвращённый
+    в очередь, получает новый запуск, а не совпадающий run_key старого.
+    """
+    fetch_op = "fetch_new_file_groups" if ETL_GROUP_ON_SERVER else "fetch_all_new_files"
+    run_requests = []
+    for activity_id, files in groups.items():
+        last_id = max(file["document_id"] for file in files)
+        run_requests.append(
+            RunRequest(
+                run_key=f"{activity_id}:{last_id}:{tick_key}" if tick_key else f"{activity_id}:{last_id}",
+                run_config={
+                    **(EXECUTOR_CONFIG or {}),
+                    "ops": {
+                        fetch_op: {
+                            "config": {"activity_id": activity_id, "limit": len(files)}
+                        }
+                    },
+                },
+                tags={"etl/activity": str(activity_id)},
+            )
+        )
+    return run_requests
+
+
+@sensor(
+    job=process_all_new_files,
+    minimum_interval_seconds=ETL_SENSOR_INTERVAL,
+    required_resource_keys={"mongo_client"},
+)
+def new_files_sensor(context: SensorEvaluationContext):
+    """
+    Запускает обработку только что загруженных и возвращённых в очередь файлов.
+    Курсор сенсора хранит:
+        - last_id: наибольший _id уже учтённого документа (режим "watermark")
+        - requeued_at: время последнего учтённого возврата в очередь (режим "watermark")
+        - resume_token: токен change stream (режим "change_stream")
+    В режиме "auto" используется change stream, а если MongoDB его
+    не поддерживает (не replica set) - опрос по last_id и requeued_at.
+    На каждом тике в очередь возвращаются файлы с истёкшей арендой
+    (упавшие запуски), иначе их никто не освободит до следующего запуска.
+    """
+    from bson import json_util
+    from pymongo.errors import OperationFailure
+
+    mongo = context.resources.mongo_client
+    state = json_util.loads(context.cursor) if context.cursor else {}
+    mode = state.get("mode", ETL_SENSOR_MODE)
+
+    released = mongo.release_expired_leases()
+    if released:
+        context.log.info(f"new_files_sensor:\t {released} files with expired lease requeued")
+
+    files = []
+    if mode != "watermark":
+        try:
+            first_tick = "resume_token" not in state
+            files, state["resume_token"] = mongo.watch_new_files(state.get("resume_token"))
+            if first_tick:
+                # Файлы, загруженные до открытия change stream
+                groups = mongo.get_file_groups()
+                files.extend(file for group in groups.values() for file in group)
+        except OperationFailure as e:
+            if mode == "change_stream":
+                raise
+            context.log.warning(f"new_files_sensor:\t change stream unavailable, polling: {e}")
+            state.pop("resume_token", None)
+            mode = "watermark"
+    if mode == "watermark":
+        groups = mongo.get_file_groups(after_id=state.get("last_id"))
+        files = [file for group in groups.values() for file in group]
+        if files:
+            state["last_id"] = max(file["document_id"] for file in files)
+        requeued, state["requeued_at"] = mongo.get_requeued_files(state.get("requeued_at"))
+        known = {file["document_id"] for file in files}
+        files.extend(file for file in requeued if file["document_id"] not in known)
+    state["mode"] = mode
+
+    cursor = json_util.dumps(state)
+    if not files:
+        return SensorResult(skip_reason=SkipReason("No new files"), cursor=cursor)
+    context.log.info(f"new_files_sensor:\t {len(files)} new files")
+    tick_key = sha1(cursor.encode()).hexdigest()[:12]
+    return SensorResult(
+        run_requests=build_run_requests(group_by_activity(files), tick_key),
+        cursor=cursor,
+    )
@@ -0,0 +1,195 @@
+import hashlib
+import os
+from importlib.util import find_spec
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional
+import pandas as pd
+from dagster import get_dagster_logger
+from etl.tools import Mapping
+
+logger = get_dagster_logger()
+
+# Типы полей из mapping.yaml, которые приводятся после чтения отчёта.
+# Строковые поля передаются в read_excel сразу, чтобы движок не угадывал тип
+FIELD_DTYPES = {
+    "int": "Int64",
+    "float": "Float64",
+    "bool": "boolean",
+}
+
+
+def get_category_fields(mapping_schema: Dict[str, Dict]) -> List[str]:
+    """
+    Строковые поля измерений из mapping.yaml (type: string, db_table: dim_*).
+    Значения в них сильно повторяются, поэтому их выгодно хранить как category
+    """
+    return [
+        field for field, spec in mapping_schema.items()
+        if spec.get("type") == "string" and str(spec.get("db_table", "")).startswith("dim_")
+    ]
+
+
+def compact_dtypes(
+        df: pd.DataFrame,
+        category_fields: List[str],
+        max_unique_ratio: float = 0.5,
+        ) -> pd.DataFrame:
+    """
+    Переводит столбцы `category_fields` в category, если уникальных значений
+    не больше `max_unique_ratio` от числа строк. Остальные столбцы не меняются.
+    """
+    for field in category_fields:
+        if field not in df.columns or isinstance(df[field].dtype, pd.CategoricalDtype):
+            continue
+        if df[field].nunique() <= max_unique_ratio * len(df):
+            df[field] = df[field].astype("category")
+    return df
+
+
+def get_excel_engine(engine: str = "auto") -> str:
+    """
+    Возвращает движок для pd.read_excel.
+    При engine="auto" выбирается calamine (если установлен python-calamine),
+    иначе openpyxl.
+    """
+    if engine != "auto":
+        return engine
+    return "calamine" if find_spec("python_calamine") else "openpyxl"
+
+
+def read_excel(source: BinaryIO, engine: str = "auto", **kwargs) -> pd.DataFrame:
+    """pd.read_excel c выбором движка через `get_excel_engine`"""
+    return pd.read_excel(source, engine=get_excel_engine(engine), **kwargs)
+
+
+class ReportReader():
+    def __init__(
+            self,
+            mapping: Mapping,
+            field_types: Optional[Dict[str, str]] = None,
+            engine: str = "auto",
+            prune_unmapped: bool = True,
+            ):
+        """Чтение отчётов с приведением заголовков к стандартным именам.
+
+        Сначала читается только строка заголовков, заголовки сопоставляются
+        через `Mapping`, затем из файла читаются только сопоставленные столбцы.
+
+        Args:
+            mapping (Mapping): Сопоставление названий столбцов отчёта стандартным именам
+            field_types (Dict[str, str], optional): Типы стандартных полей
+                (поле `type` из mapping.yaml)
+            engine (str, optional): Движок pd.read_excel или "auto". Defaults to "auto".
+            prune_unmapped (bool, optional): Пропускать столбцы, которых нет в
+                mapping.yaml. Если False, такой столбец вызывает KeyError.
+                Defaults to True.
+        """
+        self.mapping = mapping
+        self.field_types = field_types or {}
+        self.engine = get_excel_engine(engine)
+        self.prune_unmapped = prune_unmapped
+
+    def read_header(self, source: BinaryIO) -> List[str]:
+        """Читает только строку заголовков отчёта"""
+        headers = read_excel(source, engine=self.engine, nrows=0).columns
+        source.seek(0)
+        return list(headers)
+
+    def resolve_columns(self, headers: List[str]) -> Dict[str, str]:
+        """
+        Сопоставляет заголовки отчёта стандартным именам полей.
+        Returns:
+            Dict[str, str]: {заголовок отчёта: стандартное имя}
+        """
+        columns = {}
+        for header in headers:
+            try:
+                columns[header] = self.mapping.get(str(header))
+            except KeyError:
+                if not self.prune_unmapped:
+                    raise
+                logger.warning(f"ReportReader:\t column '{header}' is not mapped, skipped")
+        return columns
+
+    def read(self, source: BinaryIO, columns: Dict[str, str]) -> pd.DataFrame:
+        """
+        Читает из отчёта только столбцы `columns` и переименовывает их
+        в стандартные имена с приведением типов из mapping.yaml.
+        Args:
+            source (BinaryIO): Файл отчёта
+            columns (Dict[str, str]): Результат `resolve_columns`
+        """
+        dtype = {
+            header: "string"
+            for header, field in columns.items()
+            if self.field_types.get(field) == "string"
+        }
+        df = read_excel(
+            source,
+            engine=self.engine,
+            usecols=list(columns),
+            dtype=dtype,
+        )
+        df = df.rename(columns=columns)
+        for field in df.columns.unique():
+            field_dtype = FIELD_DTYPES.get(self.field_types.get(field))
+            if field_dtype is None:
+                continue
+            try:
+                df[field] = df[field].astype(field_dtype)
+            except (TypeError, ValueError) as e:
+                logger.warning(f"ReportReader:\t {field} left as {df[field].dtype}: {e}")
+        return df
+
+
+class ReportCache():
+    def __init__(self, cache_dir: str, *key_parts: str):
+        """Кэш разобранных отчётов в формате Parquet.
+
+        Отчёт хранится под именем sha256(ETag файла + `key_parts`).
+        В `key_parts` передаётся всё, от чего зависит результат разбора
+        (хэш mapping.yaml, настройки ReportReader), поэтому после изменения
+        mapping.yaml отчёты разбираются заново.
+        Требует pyarrow; без него кэш выключен (`enabled` = False).
+
+        Args:
+            cache_dir (str): Каталог кэша
+            *key_parts (str): Дополнительные части ключа
+        """
+        self.enabled = find_spec("pyarrow") is not None
+        if not self.enabled:
+            logger.warning("ReportCache:\t pyarrow is not installed, report cache disabled")
+            return
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.key = hashlib.sha256("/".join(key_parts).encode()).hexdigest()
+
+    def path(self, etag: str) -> Path:
+        digest = hashlib.sha256(f"{self.key}/{etag.strip(chr(34))}".encode()).hexdigest()
+        return self.cache_dir / f"{digest}.parquet"
+
+    def load(self, etag: Optional[str]) -> Optional[pd.DataFrame]:
+        """Возвращает разобранный отчёт из кэша или None"""
+        if not self.enabled or not etag:
+            return None
+        path = self.path(etag)
+        if not path.exists():
+            return None
+        try:
+            return pd.read_parquet(path, memory_map=True)
+        except Exception as e:
+            logger.warning(f"ReportCache:\t {path.name} not loaded: {e}")
+            return None
+
+    def save(self, etag: Optional[str], df: pd.DataFrame) -> None:
+        """Сохраняет разобранный отчёт. Запись атомарная"""
+        if not self.enabled or not etag:
+            return
+        path = self.path(etag)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+        except Exception as e:
+            tmp.unlink(missing_ok=True)
+            logger.warning(f"ReportCache:\t {path.name} not saved: {e}")
@@ -1,6 +1,5 @@
 from os import getenv
-from dagster import EnvVar, resource
-from etl.models import Minio, MongoDB, DWHModel
+from dagster import EnvVar, Field, resource
 
 
 # ==============================
@@ -8,30 +7,180 @@ from etl.models import Minio, MongoDB, DWHModel
 # ==============================
 
 
-@resource
+@resource(
+    config_schema={
+        "status_batch_size": Field(
+            int,
+            default_value=1000,
+            description="Количество документов в одном update_many при обновлении статусов",
+        ),
+        "ensure_indexes": Field(
+            bool,
+            default_value=True,
+            description=(
+                "Создать индексы коллекции при старте ресурса в запуске job "
+                "(на тиках сенсора индексы не создаются)"
+            ),
+        ),
+    }
+)
 def mongo_client_resource(context):
-    return MongoDB()
+    # Модели импортируются при создании ресурса, а не при загрузке code location
+    from etl.models import MongoDB
+    mongo = MongoDB(status_batch_size=context.resource_config["status_batch_size"])
+    # Сенсор создаёт ресурс на каждом тике (dagster_run нет), индексы
+    # достаточно проверить при старте запуска
+    if context.resource_config["ensure_indexes"] and context.dagster_run is not None:
+        try:
+            mongo.ensure_indexes()
+        except Exception as e:
+            context.log.warning(f"mongo_client:\t indexes not created: {e}")
+    try:
+        yield mongo
+    finally:
+        mongo.close()
 
 
-@resource
+@resource(
+    config_schema={
+        "download_workers": Field(
+            int,
+            default_value=8,
+            description="Количество потоков для параллельного скачивания файлов группы",
+        ),
+        "spool_threshold": Field(
+            int,
+            default_value=32 * 1024 * 1024,
+            description=(
+                "Размер файла в байтах, после которого скачанный файл "
+                "хранится во временном файле на диске, а не в памяти"
+            ),
+        ),
+        "cache_dir": Field(
+            str,
+            default_value="",
+            description=(
+                "Каталог локального кэша скачанных файлов. "
+                "Пустая строка - кэш выключен"
+            ),
+        ),
+        "cache_max_bytes": Field(
+            int,
+            default_value=2 * 1024 ** 3,
+            description="Максимальный размер локального кэша скачанных файлов в байтах",
+        ),
+    }
+)
 def s3_client_resource(context):
-    return Minio()
+    from etl.models import Minio
+    from etl.models.file_cache import DownloadCache
+    cache_dir = context.resource_config["cache_dir"]
+    return Minio(
+        max_workers=context.resource_config["download_workers"],
+        spool_threshold=context.resource_config["spool_threshold"],
+        cache=DownloadCache(
+            cache_dir,
+            max_bytes=context.resource_config["cache_max_bytes"],
+        ) if cache_dir else None,
+    )
 
 
-@resource
+@resource(
+    config_schema={
+        "use_copy": Field(
+            bool,
+            default_value=True,
+            description=(
+                "Загружать данные через COPY во временную таблицу. "
+                "False - старый путь через INSERT ... VALUES"
+            ),
+        ),
+        "lookup_chunk_size": Field(
+            int,
+            default_value=5000,
+            description=(
+                "Количество ключей в одном запросе поиска существующих "
+                "записей измерений и фактов"
+            ),
+        ),
+        "dim_cache_size": Field(
+            int,
+            default_value=100_000,
+            description=(
+                "Максимальное количество ключей в кэше одного измерения, "
+                "0 - кэш выключен. Кэш общий для всех шагов процесса"
+            ),
+        ),
+        "warm_dim_cache": Field(
+            bool,
+            default_value=False,
+            description="Загрузить измерения в кэш целиком при первом старте ресурса в процессе",
+        ),
+        "pool_size": Field(
+            int,
+            default_value=5,
+            description="Количество постоянных соединений в пуле (общем для процесса)",
+        ),
+        "max_overflow": Field(
+            int,
+            default_value=10,
+            description="Количество дополнительных соединений сверх pool_size",
+        ),
+        "pool_pre_ping": Field(
+            bool,
+            default_value=True,
+            description="Проверять соединение из пула перед использованием",
+        ),
+        "statement_timeout_ms": Field(
+            int,
+            default_value=0,
+            description="Ограничение времени одного запроса в миллисекундах, 0 - без ограничения",
+        ),
+        "fact_upsert": Field(
+            str,
+            default_value="",
+            description=(
+                "Загрузка фактов через INSERT ... ON CONFLICT по unique_key из schema.yaml: "
+                "'nothing' или 'update'. Пустая строка - поиск существующих фактов "
+                "по всем полям. Требует индексов из dwh2.2_fact_keys.sql"
+            ),
+        ),
+        "dim_workers": Field(
+            int,
+            default_value=4,
+            description=(
+                "Количество потоков для параллельного поиска записей измерений "
+                "activity, 1 - поиск по очереди"
+            ),
+        ),
+    }
+)
 def target_db_resource(context):
+    from etl.models import DWHModel
     # db_url = (
     #     f"postgresql://{EnvVar('DB_USER')}:{EnvVar('DB_PASS')}
     #     f"@{EnvVar('DB_HOST')}:{EnvVar('DB_PORT')}/{EnvVar('DB_NAME')}"
     # )
     
-    return DWHModel(
+    model = DWHModel(
         db_host=getenv('DB_HOST'),
         db_port=getenv('DB_PORT'),
         db_name=getenv('DB_NAME'),
         db_user=getenv('DB_USER'),
         db_pass=getenv('DB_PASS'),
+        use_copy=context.resource_config["use_copy"],
+        lookup_chunk_size=context.resource_config["lookup_chunk_size"],
+        dim_cache_size=context.resource_config["dim_cache_size"],
+        pool_size=context.resource_config["pool_size"],
+        max_overflow=context.resource_config["max_overflow"],
+        pool_pre_ping=context.resource_config["pool_pre_ping"],
+        statement_timeout_ms=context.resource_config["statement_timeout_ms"],
+        fact_upsert=context.resource_config["fact_upsert"],
+        dim_workers=context.resource_config["dim_workers"],
     )
+    if context.resource_config["warm_dim_cache"]:
+        model.warm_dim_cache()
+    return model
     
     
 if __name__ == "__main__":
@@ -1,10 +1,21 @@
-from typing import Dict
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
+from collections import Counter, OrderedDict
+from pathlib import Path
 from pandas import DataFrame
-from sqlalchemy.engine import Engine
+import csv
 import difflib
+import os
+import re
 import pandas as pd
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype
 from datetime import date, datetime, timedelta
 from dateutil import parser
+from dagster import get_dagster_logger
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+
+logger = get_dagster_logger()
 
 def revert_dict(dictionary: Dict) -> Dict:
     """
@@ -45,8 +56,118 @@ def revert_dict(dictionary: Dict) -> Dict:
         raise TypeError("All values in the input dictionary must be hashable.") from e
     
 
+def normalize_header(header: str) -> str:
+    """
+    Приводит название столбца к виду для нечувствительного сравнения:
+    нижний регистр, ё -> е, без пробелов и знаков препинания.
+    >>> normalize_header("Ф.И.О.") == normalize_header("Ф И О") == "фио"
+    """
+    return re.sub(r"[\W_]+", "", str(header).casefold().replace("ё", "е"))
+
+
+def get_trigrams(value: str) -> set:
+    """Возвращает множество триграмм строки (с краевыми пробелами)"""
+    value = f"  {value} "
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def map_categories(series: pd.Series, func) -> pd.Series:
+    """
+    Применяет `func` (преобразование pd.Series -> pd.Series) только к
+    уникальным значениям категориального столбца и возвращает категориальный
+    столбец. Для остальных типов `func` применяется ко всему столбцу.
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return func(series)
+    if series.cat.categories.empty:
+        return series
+    new_codes, new_categories = pd.factorize(func(pd.Series(series.cat.categories)))
+    codes = series.cat.codes.to_numpy()
+    remapped = new_codes.take(codes, mode="clip")
+    # Пустые значения (код -1) остаются пустыми
+    remapped[codes < 0] = -1
+    return pd.Series(
+        pd.Categorical.from_codes(remapped, categories=new_categories),
+        index=series.index,
+        name=series.name,
+    )
+
+
+# Нулевой день дат Excel в числовом виде (серийный номер 1 = 1900-01-01)
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+
+
+def to_date_id(values: pd.Series) -> pd.Series:
+    """
+    Переводит даты в ключ dim_date (int в формате YYYYMMDD) без обхода
+    строк: year * 10000 + month * 100 + day.
+    Принимает datetime64, строки с датой (в т.ч. ДД.ММ.ГГГГ), числа
+    YYYYMMDD и серийные номера дат Excel. Пустые значения (NaN, пустые
+    строки) становятся <NA>.
+
+    Returns:
+        pd.Series: столбец типа Int32
+    Raises:
+        ValueError: непустые значения, которые не удалось распознать как дату
+    """
+    if is_datetime64_any_dtype(values):
+        dates = values
+    elif is_bool_dtype(values):
+        dates = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+    else:
+        numbers = pd.to_numeric(values.astype(object), errors="coerce")
+        # Строки: сначала ISO 8601, остальные как ДД.ММ.ГГГГ
+        text = values.astype(object).where(numbers.isna())
+        dates = pd.to_datetime(text, errors="coerce", format="ISO8601")
+        dates = dates.fillna(
+            pd.to_datetime(
+                text.where(dates.isna()), errors="coerce", dayfirst=True, format="mixed"
+            )
+        )
+        # Число вида YYYYMMDD уже является ключом даты, остальные числа -
+        # серийные номера Excel
+        is_date_id = numbers.between(10000101, 99991231)
+        date_ids = numbers.where(is_date_id)
+        dates = dates.fillna(
+            pd.to_datetime(
+                pd.DataFrame({
+                    "year": date_ids // 10000,
+                    "month": date_ids // 100 % 100,
+                    "day": date_ids % 100,
+                }),
+                errors="coerce",
+            )
+        )
+        serials = numbers.where(~is_date_id & numbers.between(1, 2958465))
+        # Дробная часть серийного номера - время суток
+        dates = dates.fillna(EXCEL_EPOCH + pd.to_timedelta(serials // 1, unit="D"))
+    date_id = dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day
+    # Нераспознанная дата - ошибка в отчёте, а не пустое значение:
+    # иначе факт загрузится без даты и check_date_ids её не заметит
+    empty = values.isna() | values.astype("string").str.strip().eq("").fillna(True)
+    invalid = values[date_id.isna() & ~empty]
+    if not invalid.empty:
+        raise ValueError(
+            f"{values.name}: {len(invalid)} values are not dates, "
+            f"e.g. {invalid.astype(str).unique().tolist()[:5]}"
+        )
+    return date_id.astype("Int32")
+
+
 class Mapping():
-    def __init__(self, mapping: Dict, threshold: float = 0.8) -> None:
+    # Отметка в кэше для заголовков, которые не удалось сопоставить
+    _NOT_FOUND = object()
+
+    def __init__(
+            self,
+            mapping: Dict,
+            threshold: float = 0.8,
+            short_threshold: float = 0.9,
+            short_length: int = 12,
+            cache_size: int = 10_000,
+            max_candidates: int = 20,
+            learned_path: Optional[Union[str, Path]] = None,
+            ) -> None:
         '''
             Класс принимает словарь где ключом  является стандартное имя поля,
             а значением ключа список названий которые надо заенить 
@@ -64,6 +185,16 @@ class Mapping():
                 mapping (Dict): Словарь для замены различных названий полей на стандартное
                 threshold (float): Уровень совпадения строки в случае если в заголовках 
                 названий полей имеются опечатки
+                short_threshold (float): Уровень совпадения для названий короче
+                short_length символов после нормализации
+                short_length (int): Длина нормализованного названия, начиная
+                с которой используется threshold
+                cache_size (int): Количество запоминаемых результатов сопоставления
+                (в том числе неудачных)
+                max_candidates (int): Количество кандидатов из триграммного индекса,
+                которые сравниваются нечётким поиском
+                learned_path (str | Path, optional): CSV файл (header,key) с
+                сопоставлениями, найденными нечётким поиском в прошлых запусках
         '''
         if not mapping:
             raise ValueError("Mapping is empty.")
@@ -72,28 +203,133 @@ class Mapping():
         if any(isinstance(v, (list, tuple)) for v in mapping.values()) :
             self.mapping = revert_dict(mapping)
         else:
-            self.mapping = mapping
+            # Копия: словарь может быть общим (get_header_index),
+            # а load_learned дописывает в него сопоставления
+            self.mapping = dict(mapping)
         self.threshold = threshold
-    
+        self.short_threshold = short_threshold
+        self.short_length = short_length
+        self.cache_size = cache_size
+        self.max_candidates = max_candidates
+        self.learned_path = Path(learned_path) if learned_path else None
+        self.learned: Dict[str, str] = {}
+        self._cache: OrderedDict = OrderedDict()
+        if self.learned_path is not None and self.learned_path.exists():
+            self.load_learned(self.learned_path)
+        else:
+            self._build_index()
+
+    def _build_index(self) -> None:
+        """Строит индекс нормализованных названий и триграммный индекс"""
+        names: Dict[str, set] = {}
+        for raw_name, std_name in self.mapping.items():
+            names.setdefault(normalize_header(raw_name), set()).add(std_name)
+        # Названия, которые после нормализации совпадают у разных полей,
+        # остаются в индексе без поля: ни точный, ни нечёткий поиск не
+        # выбирает одно из полей наугад
+        self._normalized: Dict[str, Optional[str]] = {}
+        for name, std_names in names.items():
+            if len(std_names) > 1:
+                logger.warning(
+                    f"Mapping:\t header '{name}' matches {sorted(std_names)}, not indexed"
+                )
+                self._normalized[name] = None
+            else:
+                self._normalized[name] = std_names.pop()
+        self._trigrams: Dict[str, set] = {}
+        for name in self._normalized:
+            for trigram in get_trigrams(name):
+                self._trigrams.setdefault(trigram, set()).add(name)
+
+    def _candidates(self, name: str) -> List[str]:
+        """Нормализованные названия с наибольшим числом общих триграмм"""
+        counter = Counter()
+        for trigram in get_trigrams(name):
+            counter.update(self._trigrams.get(trigram, ()))
+        return [candidate for candidate, _ in counter.most_common(self.max_candidates)]
+
+    def _resolve(self, key: str) -> Optional[str]:
+        if key in self.mapping:
+            return self.mapping[key]
+        name = normalize_header(key)
+        if name in self._normalized:
+            return self._normalized[name]
+        candidates = self._candidates(name) or list(self._normalized)
+        # В коротком названии одна лишняя буква или пропущенное слово
+        # ("Тема" и "Тема ИМ") дают высокий коэффициент совпадения
+        cutoff = self.short_threshold if len(name) < self.short_length else self.threshold
+        matches = difflib.get_close_matches(name, candidates, n=1, cutoff=cutoff)
+        if matches:
+            return self._normalized[matches[0]]
+        return None
+
     def get(self, key: str) -> str:
         """
         Retrieves the value associated with the given key from the mapping.
-        If the key is not found, returns the key itself.
+        Results (including misses) are memoized; a miss is resolved through
+        the normalized index, then by fuzzy matching against trigram candidates.
 
         Args:
             key (str): The key to look for in the mapping.
 
         Returns:
-            str: The value associated with the key if found, otherwise the key itself.
+            str: The value associated with the key if found.
+
+        Raises:
+            KeyError: If the key can not be matched.
         """
-        if key in self.mapping:
-            return self.mapping[key]
-        matches = difflib.get_close_matches(key, self.mapping.keys(), n=1, cutoff=self.threshold)
-        if matches:
-            return self.mapping[matches[0]]
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            value = self._cache[key]
         else:
-            print(self.mapping)
+            value = self._resolve(key)
+            if value is not None and key not in self.mapping:
+                self.learned[key] = value
+            self._cache[key] = self._NOT_FOUND if value is None else value
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        if value is None or value is self._NOT_FOUND:
             raise KeyError(f"Key '{key}' not found in mapping.")
+        return value
+
+    def load_learned(self, path: Union[str, Path]) -> None:
+        """
+        Добавляет в словарь сопоставления из CSV файла (header,key).
+        Строки с неизвестным стандартным именем пропускаются.
+        """
+        path = Path(path)
+        if not path.exists():
+            return
+        std_names = set(self.mapping.values())
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                header = (row.get("header") or "").strip()
+                std_name = (row.get("key") or "").strip()
+                if header and std_name in std_names:
+                    self.mapping.setdefault(header, std_name)
+        self._build_index()
+
+    def save_learned(self, path: Optional[Union[str, Path]] = None) -> None:
+        """
+        Дописывает в CSV файл (header,key) сопоставления, найденные нечётким
+        поиском, чтобы следующие запуски находили их сразу.
+        Без `path` и learned_path ничего не записывает.
+        """
+        path = Path(path) if path else self.learned_path
+        if path is None or not self.learned:
+            return
+        rows = {}
+        if path.exists():
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                rows = {row["header"]: row["key"] for row in csv.DictReader(f)}
+        rows.update(self.learned)
+        tmp_path = path.with_suffix(f"{path.suffix}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["header", "key"])
+            writer.writerows(rows.items())
+        os.replace(tmp_path, path)
+        self.learned.clear()
         
         
 def create_date_dim(
@@ -160,12 +396,12 @@ def get_random_date(start_date, end_date):
 
 
 
-def load_location_to_db(engine: Engine)-> None:
+def load_location_to_db(engine: "Engine")-> None:
     locations = pd.read_csv("etl\\data\\locations.csv")
     locations = locations.drop(columns=["id"])
     locations.to_sql("dim_location", engine, if_exists="append", index=False)
 
-def load_date_dim_to_db(engine: Engine)-> None:
+def load_date_dim_to_db(engine: "Engine")-> None:
     start_date = "2020, 1, 1"
     end_date = "2030, 12, 31"
     date_dim = create_date_dim(start_date, end_date)
@@ -0,0 +1,77 @@
+import re
+
+import pandas as pd
+
+from etl.models.load_plan import BridgeStep
+from etl.models.pg_model import explode_list_values
+
+NOT_LETTERS = r"[^а-яА-ЯёЁa-zA-Z\s]"
+VOLUNTEERS = BridgeStep(
+    table="volunteers_in_events",
+    list_field="volunteers",
+    dimension="dim_staff",
+    key_col="staff_id",
+    dimension_fields={"name": "volunteers", "type": "volunteers_type"},
+    dim_col="volunteer_id",
+    fact_col="fact_event_id",
+    separator=", ",
+    clean_pattern=NOT_LETTERS,
+)
+
+
+def iterrows_volunteers(df: pd.DataFrame) -> pd.DataFrame:
+    """Записи волонтёров, как их строил load_events_facts до векторизации"""
+    volunteers = []
+    for row_number, (_, row) in enumerate(df.iterrows()):
+        for volunteer in row["volunteers"].split(", "):
+            volunteers.append({
+                "row": row_number,
+                "name": re.sub(NOT_LETTERS, "", volunteer).strip(),
+                "type": re.sub(NOT_LETTERS, "", row["volunteers_type"]).strip(),
+            })
+    return pd.DataFrame(volunteers)
+
+
+def make_report() -> pd.DataFrame:
+    row = {"event_name": "Урок", "volunteers_type": "студенты"}
+    return pd.DataFrame([
+        dict(row, volunteers="Иванов И.И., Петров П.П."),
+        # Неразрывные пробелы внутри и по краям имени
+        dict(row, volunteers="\xa0Сидорова\xa0Анна\xa0, Smith J."),
+        # Пустые имена и имена только из знаков препинания
+        dict(row, volunteers=", ..., Кузнецов"),
+        dict(row, volunteers=""),
+        dict(row, volunteers="Иванов И.И.", volunteers_type=" волонтёры-медики! "),
+        # Полные дубликаты строк отчёта
+        dict(row, volunteers="Иванов И.И., Петров П.П."),
+        dict(row, volunteers="Иванов И.И., Петров П.П."),
+    ], index=[10, 11, 12, 13, 14, 15, 16])
+
+
+def test_explode_matches_iterrows():
+    df = make_report()
+    expected = iterrows_volunteers(df)
+    result = explode_list_values(df, VOLUNTEERS)
+    pd.testing.assert_frame_equal(
+        result.astype(object), expected.astype(object), check_dtype=False
+    )
+
+
+def test_explode_matches_iterrows_for_arrow_strings():
+    df = make_report().astype({"volunteers": "string[pyarrow]", "volunteers_type": "string[pyarrow]"})
+    expected = iterrows_volunteers(df)
+    result = explode_list_values(df, VOLUNTEERS)
+    assert result["name"].tolist() == expected["name"].tolist()
+    assert result["type"].tolist() == expected["type"].tolist()
+
+
+def test_explode_skips_missing_lists():
+    df = pd.DataFrame({
+        "volunteers": ["Иванов", None, "Петров, Сидоров"],
+        "volunteers_type": ["студенты", "студенты", None],
+    })
+    result = explode_list_values(df, VOLUNTEERS)
+    assert result["row"].tolist() == [0, 2, 2]
+    assert result["name"].tolist() == ["Иванов", "Петров", "Сидоров"]
+    assert result["type"].tolist()[0] == "студенты"
+    assert result["type"].isna().tolist() == [False, True, True]
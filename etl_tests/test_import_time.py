@@ -0,0 +1,59 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# Библиотеки, которые code location не должен загружать при импорте:
+# модели и их клиенты импортируются при создании ресурсов
+HEAVY_MODULES = ["sqlalchemy", "psycopg2", "boto3", "pymongo"]
+# Время импорта проверяется только с ETL_BENCHMARK=1: на общих CI-машинах
+# оно зависит от загрузки и диска
+BENCHMARK = os.getenv("ETL_BENCHMARK", "").lower() in ("1", "true", "yes")
+# Время импорта etl.definitions целиком (вместе с dagster) и собственных
+# модулей etl, в секундах
+TOTAL_BUDGET = float(os.getenv("ETL_IMPORT_BUDGET", 3.0))
+OWN_BUDGET = float(os.getenv("ETL_IMPORT_OWN_BUDGET", 0.25))
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def import_definitions():
+    """Импортирует etl.definitions в отдельном процессе с -X importtime.
+    Возвращает загруженные тяжёлые модули и {модуль: (self, cumulative)} в секундах"""
+    code = (
+        "import sys, json, etl.definitions; "
+        f"print(json.dumps(sorted(set({HEAVY_MODULES!r}) & set(sys.modules))))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = (
+            part.strip() for part in line[len("import time:"):].split("|")
+        )
+        times[name] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+    return json.loads(result.stdout.splitlines()[-1]), times
+
+
+def test_definitions_import_is_light():
+    loaded, _ = import_definitions()
+    assert loaded == []
+
+
+@pytest.mark.skipif(not BENCHMARK, reason="ETL_BENCHMARK")
+def test_definitions_import_time():
+    _, times = import_definitions()
+    total = times["etl.definitions"][1]
+    own = sum(self_s for name, (self_s, _) in times.items() if name.split(".")[0] == "etl")
+    print(f"etl.definitions: {total:.2f}s, etl modules: {own:.3f}s")
+    assert total < TOTAL_BUDGET
+    assert own < OWN_BUDGET
@@ -0,0 +1,111 @@
+import pandas as pd
+import pytest
+from dagster import (
+    DynamicOut,
+    DynamicOutput,
+    Out,
+    ReexecutionOptions,
+    execute_job,
+    in_process_executor,
+    instance_for_test,
+    job,
+    op,
+    reconstructable,
+    resource,
+)
+
+from etl.models import Meta
+from etl.pipelines.graph import lease_owner, load_dimensions_and_facts, update_mongo_status
+
+mongomock = pytest.importorskip("mongomock")
+
+from etl.models.mongo_model import MongoDB  # noqa: E402
+
+
+def make_mongo() -> MongoDB:
+    mongo = MongoDB.__new__(MongoDB)
+    mongo.status_batch_size = 1000
+    mongo.client = mongomock.MongoClient()
+    mongo.db = mongo.client["etl"]
+    mongo.collection = mongo.db["reports"]
+    return mongo
+
+
+class FlakyDWH:
+    """Целевая БД, загрузка в которую падает при первом вызове"""
+    plans = {"1": None}
+
+    def __init__(self):
+        self.calls = 0
+
+    def dispatch(self, key, df):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("DWH is unavailable")
+        return len(df)
+
+
+# Ресурсы общие для исходного и повторного запусков одного теста
+STATE = {}
+
+
+@resource
+def mongo_resource(_):
+    return STATE["mongo"]
+
+
+@resource
+def dwh_resource(_):
+    return STATE["dwh"]
+
+
+@op(out=DynamicOut(), required_resource_keys={"mongo_client"})
+def claim_group(context):
+    mongo = context.resources.mongo_client
+    mongo.claim_files(owner=lease_owner(context))
+    files = list(mongo.get_files_by_status(status=mongo.CLAIMED_STATUS, owner=lease_owner(context)))
+    yield DynamicOutput(files, mapping_key="1")
+
+
+@op(out={"df": Out(), "c_meta": Out()})
+def read_group(files):
+    c_meta = [Meta(document_id=file["document_id"], status="processed", reason=None) for file in files]
+    return pd.DataFrame({"filename": [file["filename"] for file in files]}), c_meta
+
+
+@job(
+    executor_def=in_process_executor,
+    resource_defs={"mongo_client": mongo_resource, "target_db": dwh_resource},
+)
+def lease_job():
+    def process(files):
+        df, c_meta = read_group(files)
+        update_mongo_status(load_dimensions_and_facts(df, c_meta))
+
+    claim_group().map(process)
+
+
+def test_reexecution_keeps_root_run_lease():
+    STATE["mongo"] = mongo = make_mongo()
+    STATE["dwh"] = FlakyDWH()
+    mongo.collection.insert_many(
+        [{"status": "new", "activity": {"id": 1}, "filename": f"f{i}.xlsx"} for i in range(3)]
+    )
+    with instance_for_test() as instance:
+        with execute_job(reconstructable(lease_job), instance=instance) as first:
+            assert not first.success
+        documents = list(mongo.collection.find())
+        assert {document["lease"]["owner"] for document in documents} == {first.run_id}
+
+        options = ReexecutionOptions.from_failure(first.run_id, instance)
+        with execute_job(
+            reconstructable(lease_job), instance=instance, reexecution_options=options
+        ) as second:
+            assert second.success
+            assert second.run_id != first.run_id
+            assert instance.get_run_by_id(second.run_id).root_run_id == first.run_id
+
+    documents = list(mongo.collection.find())
+    assert [document["status"] for document in documents] == ["processed"] * 3
+    assert all("lease" not in document for document in documents)
+
@@ -0,0 +1,78 @@
+import pytest
+
+from etl.config import get_header_index, get_mapping
+from etl.tools import Mapping
+
+# Заголовки из mapping.yaml, которые указаны у нескольких полей: точное
+# совпадение выбирает последнее поле файла, как и до нормализации
+DUPLICATE_HEADERS = {
+    "Организация": "organizer_name",
+    "организация": "organizer_name",
+    "Учебное заведение": "edu_org_name",
+    "учебное заведение": "edu_org_name",
+    "Место проведения": "auditorium",
+}
+
+
+@pytest.fixture(scope="module")
+def mapping():
+    return Mapping(get_header_index())
+
+
+def test_mapping_headers_resolve_to_their_field(mapping):
+    for name, field in get_mapping().items():
+        for header in field["matches"]:
+            assert mapping.get(header) == DUPLICATE_HEADERS.get(header, name), header
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("место проведения", "settlement"),
+    ("Место проведения", "auditorium"),
+    ("Им", "im_name"),
+    ("ИМ", "im_name"),
+    ("Имя", "fullname"),
+    ("ИМЯ", "fullname"),
+    ("  ФИО ", "fullname"),
+    # Варианты написания заголовков нескольких полей следуют точному совпадению
+    ("ОРГАНИЗАЦИЯ", "organizer_name"),
+    ("Учебное  заведение", "edu_org_name"),
+    ("Количество участников", "participants_cnt"),
+    ("Наименование ИМ", "im_name"),
+    ("Тема ИМ", "im_topic"),
+])
+def test_resolutions(mapping, header, expected):
+    assert mapping.get(header) == expected
+
+
+@pytest.mark.parametrize("header", [
+    # Нормализованное название совпадает у разных полей
+    "МЕСТО ПРОВЕДЕНИЯ",
+    "Место  проведения.",
+    # Короткие названия, совпадающие с началом заголовков других полей
+    "Количество",
+    "Тема",
+])
+def test_ambiguous_headers_are_not_mapped(mapping, header):
+    with pytest.raises(KeyError):
+        mapping.get(header)
+
+
+def test_typo_in_long_header(mapping):
+    assert mapping.get("Количество учасников") == "participants_cnt"
+
+
+def test_learned_headers_are_saved_only_to_given_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    mapping = Mapping(get_header_index())
+    assert mapping.get("Количество учасников") == "participants_cnt"
+    mapping.save_learned()
+    assert list(tmp_path.iterdir()) == []
+
+    path = tmp_path / "learned_headers.csv"
+    mapping = Mapping(get_header_index(), learned_path=path)
+    mapping.get("Количество учасников")
+    mapping.save_learned()
+    assert path.read_text(encoding="utf-8").splitlines() == [
+        "header,key", "Количество учасников,participants_cnt"
+    ]
+    assert Mapping(get_header_index(), learned_path=path).mapping["Количество учасников"] == "participants_cnt"
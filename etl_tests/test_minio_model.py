@@ -0,0 +1,28 @@
+import pytest
+
+from etl.models.minio_model import Minio
+
+
+class HeadClient:
+    """Клиент S3, в котором нет объекта missing.xlsx"""
+
+    def head_object(self, Bucket, Key):
+        if Key == "missing.xlsx":
+            raise ConnectionError("head_object failed")
+        return {"ETag": f'"{Key}-etag"'}
+
+
+def test_get_etag_raises():
+    minio = Minio()
+    minio.client = HeadClient()
+    assert minio.get_etag("a.xlsx") == "a.xlsx-etag"
+    with pytest.raises(ConnectionError):
+        minio.get_etag("missing.xlsx")
+
+
+def test_get_etags_bypasses_cache_with_reason(caplog):
+    minio = Minio(max_workers=2)
+    minio.client = HeadClient()
+    etags = minio.get_etags(["a.xlsx", "missing.xlsx", "b.xlsx"])
+    assert etags == {"a.xlsx": "a.xlsx-etag", "missing.xlsx": None, "b.xlsx": "b.xlsx-etag"}
+    assert "missing.xlsx: no ETag, cache bypassed: head_object failed" in caplog.text
@@ -0,0 +1,78 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from etl.models.pg_model import get_row_tuples
+
+# Большие наборы запускаются только с ETL_BENCHMARK=1:
+# старый построитель параметров на 1M строк работает около минуты
+BENCHMARK = os.getenv("ETL_BENCHMARK", "").lower() in ("1", "true", "yes")
+FIELDS = ["name", "type", "hours", "date"]
+
+
+def iterrows_params(df: pd.DataFrame, fields):
+    """Параметры запроса, как их строил get_query_params до перехода на кортежи:
+    именованный параметр на каждую ячейку"""
+    param_dict = {}
+    placeholders_parts = []
+    for i, (_, row) in enumerate(df.iterrows()):
+        row_placeholders = []
+        for j, col in enumerate(fields):
+            param_name = f"val_{i}_{j}"
+            value = row[col]
+            if hasattr(value, "item"):
+                value = value.item()
+            param_dict[param_name] = value
+            row_placeholders.append(f":{param_name}")
+        placeholders_parts.append(f"({', '.join(row_placeholders)})")
+    return param_dict, ", ".join(placeholders_parts)
+
+
+def make_frame(rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "name": [f"ФИО {i}" for i in range(rows)],
+        "type": rng.choice(["учитель", "студент", "волонтёр"], rows),
+        "hours": rng.integers(1, 100, rows).astype(float),
+        "date": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, rows), "D"),
+    })
+    df.loc[::7, "hours"] = np.nan
+    df.loc[::11, "date"] = pd.NaT
+    return df
+
+
+def normalize(value):
+    return None if value is None or pd.isna(value) else value
+
+
+def test_row_tuples_match_iterrows():
+    df = make_frame(50)
+    params, _ = iterrows_params(df, FIELDS)
+    expected = [
+        tuple(normalize(params[f"val_{i}_{j}"]) for j in range(len(FIELDS)))
+        for i in range(len(df))
+    ]
+    assert get_row_tuples(df, FIELDS) == expected
+
+
+@pytest.mark.parametrize(
+    "rows",
+    [
+        10_000,
+        pytest.param(100_000, marks=pytest.mark.skipif(not BENCHMARK, reason="ETL_BENCHMARK")),
+        pytest.param(1_000_000, marks=pytest.mark.skipif(not BENCHMARK, reason="ETL_BENCHMARK")),
+    ],
+)
+def test_row_tuples_benchmark(rows):
+    df = make_frame(rows)
+    start = time.perf_counter()
+    iterrows_params(df, FIELDS)
+    old = time.perf_counter() - start
+    start = time.perf_counter()
+    get_row_tuples(df, FIELDS)
+    new = time.perf_counter() - start
+    print(f"{rows} rows: iterrows {old:.2f}s -> row tuples {new:.2f}s")
+    assert new < old
@@ -0,0 +1,76 @@
+import io
+import os
+import time
+from importlib.util import find_spec
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from etl.config import get_field_types, get_header_index
+from etl.readers import ReportReader
+from etl.tools import Mapping
+
+# Большие отчёты запускаются только с ETL_BENCHMARK=1:
+# полное чтение 500k строк через openpyxl занимает больше минуты
+BENCHMARK = os.getenv("ETL_BENCHMARK", "").lower() in ("1", "true", "yes")
+# Столбцы отчёта, которых нет в mapping.yaml
+UNMAPPED = [f"Комментарий {i}" for i in range(8)]
+
+
+def make_report(rows: int) -> bytes:
+    """xlsx с 5 сопоставленными и 8 лишними столбцами"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "Регион": rng.choice(["Регион А", "Регион Б"], rows),
+        "Район": rng.choice([f"Район {i}" for i in range(30)], rows),
+        "Город": rng.choice([f"Город {i}" for i in range(300)], rows),
+        "Дата": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, rows), "D"),
+        "Количество участников": rng.integers(1, 200, rows),
+        **{name: rng.choice(["какой-то длинный текст комментария", "другой"], rows) for name in UNMAPPED},
+    })
+    buffer = io.BytesIO()
+    engine = "xlsxwriter" if find_spec("xlsxwriter") else "openpyxl"
+    with pd.ExcelWriter(buffer, engine=engine) as writer:
+        df.to_excel(writer, index=False)
+    return buffer.getvalue()
+
+
+def full_read(data: bytes, mapping: Mapping) -> pd.DataFrame:
+    """Чтение отчёта до ReportReader: все столбцы через openpyxl, затем
+    переименование заголовков"""
+    df = pd.read_excel(io.BytesIO(data), engine="openpyxl")
+    return df.drop(columns=UNMAPPED).rename(columns=mapping.get)
+
+
+def pruned_read(data: bytes, reader: ReportReader) -> pd.DataFrame:
+    source = io.BytesIO(data)
+    return reader.read(source, reader.resolve_columns(reader.read_header(source)))
+
+
+@pytest.mark.parametrize(
+    "rows",
+    [
+        1_000,
+        pytest.param(10_000, marks=pytest.mark.skipif(not BENCHMARK, reason="ETL_BENCHMARK")),
+        pytest.param(100_000, marks=pytest.mark.skipif(not BENCHMARK, reason="ETL_BENCHMARK")),
+        pytest.param(500_000, marks=pytest.mark.skipif(not BENCHMARK, reason="ETL_BENCHMARK")),
+    ],
+)
+def test_report_reader_benchmark(rows):
+    data = make_report(rows)
+    mapping = Mapping(get_header_index())
+    reader = ReportReader(mapping, field_types=get_field_types())
+    start = time.perf_counter()
+    expected = full_read(data, mapping)
+    old = time.perf_counter() - start
+    start = time.perf_counter()
+    result = pruned_read(data, reader)
+    new = time.perf_counter() - start
+    print(f"{rows} rows: openpyxl full read {old:.2f}s -> {reader.engine} pruned read {new:.2f}s")
+    assert list(result.columns) == list(expected.columns)
+    assert (result.astype(str).to_numpy() == expected.astype(str).to_numpy()).all()
+    # Без python-calamine выигрыш openpyxl от пропуска столбцов
+    # меньше разброса времени, сравнивается только результат
+    if reader.engine == "calamine":
+        assert new < old
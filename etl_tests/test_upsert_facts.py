@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+# Тесты с Postgres запускаются только с ETL_TEST_DB_URL, например
+# postgresql+psycopg2://postgres@/etl_test?host=/tmp/pgdata.
+# Тест создаёт и удаляет в этой БД таблицу upsert_race
+DB_URL = os.getenv("ETL_TEST_DB_URL", "")
+pytestmark = pytest.mark.skipif(not DB_URL, reason="ETL_TEST_DB_URL")
+TABLE = "upsert_race"
+
+
+@pytest.fixture
+def engine():
+    import sqlalchemy as sa
+
+    engine = sa.create_engine(DB_URL)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {TABLE}")
+        conn.exec_driver_sql(
+            f"CREATE TABLE {TABLE} (id serial PRIMARY KEY, name text NOT NULL UNIQUE, cnt int)"
+        )
+    yield engine
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {TABLE}")
+    engine.dispose()
+
+
+def make_model(engine, fact_upsert):
+    from etl.models.pg_model import DWHModel
+
+    model = DWHModel("localhost", 5432, "etl", "etl", "etl", fact_upsert=fact_upsert)
+    model.engine = engine
+    return model
+
+
+def wait_for_lock(engine, timeout: float = 10.0) -> None:
+    """Ждёт, пока запрос другого соединения встанет на блокировке"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with engine.connect() as conn:
+            waiting = conn.exec_driver_sql(
+                "SELECT count(*) FROM pg_stat_activity "
+                "WHERE wait_event_type = 'Lock' AND datname = current_database()"
+            ).scalar()
+        if waiting:
+            return
+        time.sleep(0.05)
+    raise TimeoutError("upsert did not wait for the concurrent insert")
+
+
+@pytest.mark.parametrize("fact_upsert", ["nothing", "update"])
+def test_upsert_returns_ids_of_rows_committed_concurrently(engine, fact_upsert):
+    """Строка с тем же ключом зафиксирована другой транзакцией, пока вставка
+    ждала её на конфликте: идентификатор этой строки тоже возвращается"""
+    model = make_model(engine, fact_upsert)
+    df = pd.DataFrame({"name": ["a", "b", "c"], "cnt": [1, 2, 3]})
+    result = {}
+    with engine.connect() as other:
+        other.exec_driver_sql(f"INSERT INTO {TABLE} (name, cnt) VALUES ('b', 20)")
+        worker = threading.Thread(
+            target=lambda: result.update(df=model.upsert_facts(df, TABLE, ["name"], "id"))
+        )
+        worker.start()
+        wait_for_lock(engine)
+        other.commit()
+        worker.join(timeout=30)
+    assert not worker.is_alive()
+    with engine.connect() as conn:
+        ids = dict(conn.exec_driver_sql(f"SELECT name, id FROM {TABLE}").fetchall())
+    assert result["df"]["id"].tolist() == [ids["a"], ids["b"], ids["c"]]
+
+
+def test_upsert_nothing_keeps_existing_rows(engine):
+    model = make_model(engine, "nothing")
+    first = model.upsert_facts(pd.DataFrame({"name": ["a"], "cnt": [1]}), TABLE, ["name"], "id")
+    second = model.upsert_facts(
+        pd.DataFrame({"name": ["a", "b"], "cnt": [10, 2]}), TABLE, ["name"], "id"
+    )
+    assert second["id"].iloc[0] == first["id"].iloc[0]
+    assert not second["id"].isna().any()
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"SELECT name, cnt FROM {TABLE} ORDER BY name").fetchall()
+    assert [tuple(row) for row in rows] == [("a", 1), ("b", 2)]